@@ -0,0 +1,123 @@
+from sqlalchemy import select, func, case, cast, extract, literal_column
+from sqlalchemy.dialects.postgresql import JSONB
+from datetime import datetime
+
+def pattern_count(column):
+    """
+    Build a SQL expression counting the patterns stored in a JSONB pattern column.
+    The detectors store `json.dumps` output, so a value is usually a JSON string holding an
+    encoded array; plain arrays are counted directly and anything else counts as zero.
+    Args:
+        column: The JSONB column holding the patterns.
+    Returns:
+        sqlalchemy.sql.ColumnElement: The per-row pattern count.
+    """
+    unwrapped = cast(column.op('#>>')(literal_column("'{}'")), JSONB)
+    return case(
+        (func.jsonb_typeof(column) == 'array', func.jsonb_array_length(column)),
+        (func.jsonb_typeof(column) == 'string', func.jsonb_array_length(unwrapped)),
+        else_=0,
+    )
+
+def in_years(column, years):
+    # A range on the column itself, unlike extract('year', ...), lets Postgres skip the partitions outside it
+    first_year, last_year = years
+    return (column >= datetime(first_year, 1, 1)) & (column < datetime(last_year + 1, 1, 1))
+
+def yearly_pattern_counts_query(table_class, pattern_columns, detection_flag, years=None):
+    # The query behind `yearly_pattern_counts`, shared with its async version in async_database.py
+    year = extract('year', table_class.post_date).label('year')
+    detected = detection_flag == True
+
+    columns = [year]
+    for name, column in pattern_columns.items():
+        columns.append(func.coalesce(func.sum(pattern_count(column)).filter(detected), 0).label(name))
+    columns.append(func.count().filter(detected).label('comment_count'))
+    columns.append(func.count().label('total_comments'))
+
+    query = (
+        select(*columns)
+        .where(table_class.post_date.is_not(None))
+        .group_by(year)
+        .order_by(year)
+    )
+    if years:
+        query = query.where(in_years(table_class.post_date, years))
+    return query
+
+def yearly_rows(source, rows):
+    return [{'source': source, **row, 'year': int(row['year'])} for row in rows]
+
+def year_range(session, table_class):
+    # First and last year with a dated comment, or (None, None) for an empty table
+    first, last = session.execute(select(func.min(table_class.post_date), func.max(table_class.post_date))).one()
+    return (first.year, last.year) if first is not None else (None, None)
+
+def yearly_pattern_counts(session, table_class, source, pattern_columns, detection_flag, years=None):
+    """
+    Aggregate pattern and comment counts per year in the database with a single table scan.
+    Args:
+        session: The database session to query with.
+        table_class: The SQLAlchemy model class for the table to aggregate.
+        source: Label stored in the `source` field of every row, e.g. 'Reddit'.
+        pattern_columns: Mapping of output name to the JSONB pattern column to count.
+        detection_flag: Boolean column marking comments with a detection.
+        years: Optional (first, last) year range to aggregate, inclusive; defaults to every year.
+    Returns:
+        list of dicts: One per year, holding source, year, each pattern count, comment_count
+        (comments with a detection) and total_comments (all comments), ordered by year.
+    """
+    query = yearly_pattern_counts_query(table_class, pattern_columns, detection_flag, years)
+    rows = session.execute(query).mappings().all()
+    print(f"Aggregation returned {len(rows)} years for {source}.")
+    return yearly_rows(source, rows)
+
+def yearly_pattern_counts_from_snapshot(snapshot_dir, table_class, source, pattern_columns, detection_flag, years=None):
+    """
+    Same aggregation as `yearly_pattern_counts`, computed from a Parquet snapshot written by
+    export_parquet.py instead of the database.
+    Args:
+        snapshot_dir: The snapshot directory.
+        table_class: The SQLAlchemy model class of the exported table.
+        source: Label stored in the `source` field of every row, e.g. 'Reddit'.
+        pattern_columns: Mapping of output name to the pattern column to count.
+        detection_flag: Boolean column marking comments with a detection.
+        years: Optional (first, last) year range to aggregate, inclusive; defaults to every year.
+    Returns:
+        list of dicts: One per year, in the same shape as `yearly_pattern_counts`.
+    """
+    # Only snapshot reads need pyarrow; the database aggregation works without it
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(snapshot_dir, format='parquet', partitioning='hive')
+    row_filter = (ds.field('source') == table_class.__tablename__) & ds.field('year').is_valid()
+    if years:
+        row_filter &= (ds.field('year') >= years[0]) & (ds.field('year') <= years[1])
+    table = dataset.to_table(
+        columns=['year', detection_flag.name, *{column.name for column in pattern_columns.values()}],
+        filter=row_filter,
+    )
+
+    detected = pc.fill_null(table[detection_flag.name], False)
+    counts = {'year': table['year']}
+    for name, column in pattern_columns.items():
+        counts[name] = pc.if_else(detected, pc.fill_null(pc.list_value_length(table[column.name]), 0), 0)
+    counts['comment_count'] = pc.cast(detected, pa.int64())
+
+    aggregated = pa.table(counts).group_by('year').aggregate(
+        [(name, 'sum') for name in pattern_columns] + [('comment_count', 'sum'), ('year', 'count')]
+    ).sort_by('year')
+
+    rows = []
+    for row in aggregated.to_pylist():
+        rows.append({
+            'source': source,
+            'year': int(row['year']),
+            **{name: row[f'{name}_sum'] for name in pattern_columns},
+            'comment_count': row['comment_count_sum'],
+            'total_comments': row['year_count'],
+        })
+    print(f"Snapshot aggregation returned {len(rows)} years for {source}.")
+    return rows
@@ -0,0 +1,178 @@
+import os
+import time
+import asyncio
+import logging
+import importlib.util
+from contextlib import asynccontextmanager
+from sqlalchemy import update
+import database
+import aggregations
+
+# Async driver for each database dialect the synchronous URL may name. They are optional, like
+# greenlet, which SQLAlchemy's asyncio extension needs: `poetry install -E async`. Callers check
+# `is_available` and keep their synchronous path otherwise.
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+# One async engine (and its connection pool) per database URL, process and event loop
+_engines = {}
+_session_makers = {}
+
+def _dialect(url):
+    return url.split('://', 1)[0].split('+')[0]
+
+def get_async_url(url=None):
+    # Same database as the synchronous sessions, through the dialect's async driver
+    url = url or database.get_database_url()
+    return f"{_dialect(url)}+{ASYNC_DRIVERS[_dialect(url)]}://{url.split('://', 1)[1]}"
+
+def is_available(url=None):
+    """
+    Tell whether async sessions can be used: DISS_DB_ASYNC is not switched off, and greenlet and
+    the async driver for the database URL are installed.
+    Args:
+        url: The synchronous database URL; defaults to DISS_DATABASE_URL or the local `diss` database.
+    Returns:
+        bool: Whether the functions of this module can run.
+    """
+    if not database._env_flag('DISS_DB_ASYNC', True):
+        return False
+    driver = ASYNC_DRIVERS.get(_dialect(url or database.get_database_url()))
+    return driver is not None and all(importlib.util.find_spec(module) for module in ('greenlet', driver))
+
+def get_async_engine(url=None):
+    """
+    Return the async engine for a database URL, creating it on first use in the running loop.
+    Pool size, overflow, pre-ping and statement echo come from the same DISS_DB_* settings as
+    `database.get_engine`.
+    Args:
+        url: The synchronous database URL; defaults to DISS_DATABASE_URL or the local `diss` database.
+    Returns:
+        sqlalchemy.ext.asyncio.AsyncEngine: The shared engine.
+    """
+    # Imported on first use, so importing this module never needs greenlet
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    # Async connections belong to the loop (and process) that opened them
+    key = (get_async_url(url), os.getpid(), id(asyncio.get_running_loop()))
+
+    if key not in _engines:
+        _engines[key] = create_async_engine(
+            key[0],
+            pool_size=int(os.environ.get('DISS_DB_POOL_SIZE', 5)),
+            max_overflow=int(os.environ.get('DISS_DB_MAX_OVERFLOW', 10)),
+            pool_pre_ping=database._env_flag('DISS_DB_PRE_PING', True),
+            echo=database._env_flag('DISS_DB_ECHO', False),
+        )
+        _session_makers[key] = async_sessionmaker(bind=_engines[key], expire_on_commit=False)
+
+    return _engines[key]
+
+async def dispose_engines():
+    # Close the pools of the running loop; call before the loop ends
+    loop_id = id(asyncio.get_running_loop())
+    for key in [key for key in _engines if key[2] == loop_id]:
+        await _engines.pop(key).dispose()
+        _session_makers.pop(key)
+
+def run(coroutine):
+    """
+    Run a coroutine from synchronous code in a new event loop, closing that loop's pools after it.
+    Args:
+        coroutine: The coroutine to run, e.g. `bulk_update_concurrently(...)`.
+    Returns:
+        The coroutine's result.
+    """
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await dispose_engines()
+
+    return asyncio.run(main())
+
+@asynccontextmanager
+async def session_scope(url=None):
+    """
+    Provide an async session that is committed on success, rolled back on error and always closed.
+    Args:
+        url: The synchronous database URL; defaults to DISS_DATABASE_URL or the local `diss` database.
+    Yields:
+        sqlalchemy.ext.asyncio.AsyncSession: The session.
+    """
+    get_async_engine(url)
+    key = (get_async_url(url), os.getpid(), id(asyncio.get_running_loop()))
+    session = _session_makers[key]()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+async def bulk_update_concurrently(model, batches, concurrency=4, url=None):
+    """
+    Apply batches of result rows to a table as executemany UPDATEs keyed on `id`, with up to
+    `concurrency` batches in flight on separate connections. Each batch commits on its own, so
+    the batches must not touch the same rows. Batches are taken from `batches` as writers free
+    up, so a generator keeps only the batches in flight in memory.
+    Args:
+        model: The SQLAlchemy model class for the table to update.
+        batches: Iterable of lists of dicts, each holding an `id` and the column values to set.
+        concurrency: The maximum number of batches written at once.
+        url: The synchronous database URL; defaults to the configured database.
+    Returns:
+        int: The number of rows written.
+    """
+    batches = iter(batches)
+
+    async def writer():
+        written = 0
+        for rows in batches:
+            if rows:
+                async with session_scope(url) as session:
+                    await session.execute(update(model), rows)
+                written += len(rows)
+        return written
+
+    start = time.perf_counter()
+    written = sum(await asyncio.gather(*(writer() for _ in range(concurrency))))
+    elapsed = time.perf_counter() - start
+
+    rate = written / elapsed if elapsed > 0 else float('inf')
+    logging.info(f"Wrote {written} rows to {model.__tablename__} in {elapsed:.2f}s ({rate:.0f} rows/s, "
+                 f"{concurrency} writers).")
+    return written
+
+async def yearly_pattern_counts(table_class, source, pattern_columns, detection_flag, concurrency=4, url=None):
+    """
+    Same result as `aggregations.yearly_pattern_counts`, as one query per year with up to
+    `concurrency` of them running at once on separate connections. On a table partitioned by
+    year each query reads a single partition.
+    Args:
+        table_class: The SQLAlchemy model class for the table to aggregate.
+        source: Label stored in the `source` field of every row, e.g. 'Reddit'.
+        pattern_columns: Mapping of output name to the JSONB pattern column to count.
+        detection_flag: Boolean column marking comments with a detection.
+        concurrency: The maximum number of queries running at once.
+        url: The synchronous database URL; defaults to the configured database.
+    Returns:
+        list of dicts: One per year, in the same shape as `aggregations.yearly_pattern_counts`.
+    """
+    async with session_scope(url) as session:
+        first_year, last_year = await session.run_sync(aggregations.year_range, table_class)
+    if first_year is None:
+        return []
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def count(year):
+        query = aggregations.yearly_pattern_counts_query(table_class, pattern_columns, detection_flag, (year, year))
+        async with semaphore, session_scope(url) as session:
+            return (await session.execute(query)).mappings().all()
+
+    per_year = await asyncio.gather(*(count(year) for year in range(first_year, last_year + 1)))
+    rows = aggregations.yearly_rows(source, [row for rows in per_year for row in rows])
+    print(f"Aggregation returned {len(rows)} years for {source}.")
+    return rows
@@ -0,0 +1,108 @@
+import logging
+import time
+from sqlalchemy import or_, select, update
+import models
+
+TABLE_MODELS = {
+    'test': models.Test,
+    'usenet': models.Usenet,
+    'reddit': models.Reddit,
+}
+
+def get_model(table_name):
+    try:
+        return TABLE_MODELS[table_name]
+    except KeyError:
+        raise ValueError("Invalid table name. Choose 'test', 'usenet', or 'reddit'.")
+
+def stream_rows(session, model, columns, batch_size, *criteria):
+    """
+    Stream rows of the given columns from a table in id order, one batch at a time.
+    Uses keyset pagination on `id`, so every batch is an index range scan no matter how far
+    into the table it is, and rows updated between batches are neither skipped nor repeated.
+    Args:
+        session: The database session to read with.
+        model: The SQLAlchemy model class for the table to read.
+        columns: The columns to select; must include `model.id`.
+        batch_size: The maximum number of rows per batch.
+        criteria: Optional filter expressions applied to every batch.
+    Returns:
+        generator: Yields lists of rows.
+    """
+    last_id = None
+    while True:
+        query = select(*columns).where(*criteria)
+        if last_id is not None:
+            query = query.where(model.id > last_id)
+        rows = session.execute(query.order_by(model.id).limit(batch_size)).all()
+
+        if not rows:
+            return
+
+        yield rows
+        last_id = rows[-1].id
+
+def stream_comments(session, model, batch_size, *criteria):
+    """
+    Stream (id, comment) tuples from a table in id order, one batch at a time.
+    Args:
+        session: The database session to read with.
+        model: The SQLAlchemy model class for the table to read.
+        batch_size: The maximum number of rows per batch.
+        criteria: Optional filter expressions applied to every batch.
+    Returns:
+        generator: Yields lists of (id, comment) tuples.
+    """
+    for rows in stream_rows(session, model, [model.id, model.comment], batch_size, *criteria):
+        yield [(row.id, row.comment) for row in rows]
+
+def bulk_update(session, model, rows):
+    """
+    Apply a batch of result rows to a table as a single executemany UPDATE keyed on `id`.
+    The caller is responsible for committing.
+    Args:
+        session: The database session to write with.
+        model: The SQLAlchemy model class for the table to update.
+        rows: List of dicts, each holding an `id` and the column values to set.
+    Returns:
+        int: The number of rows written.
+    """
+    if not rows:
+        return 0
+
+    start = time.perf_counter()
+    session.execute(update(model), rows)
+    elapsed = time.perf_counter() - start
+
+    rate = len(rows) / elapsed if elapsed > 0 else float('inf')
+    logging.info(f"Wrote {len(rows)} rows to {model.__tablename__} in {elapsed:.2f}s ({rate:.0f} rows/s).")
+    return len(rows)
+
+def needs_processing(version_column, current_version):
+    # Rows never processed, or processed by an older ruleset
+    return or_(version_column.is_(None), version_column < current_version)
+
+def write_results(session, model, comment_ids, rows, defaults):
+    """
+    Write a processed batch: rows with a result get their own values, and every other id in
+    the batch gets `defaults` in one UPDATE, so each processed row carries its version marker.
+    The caller is responsible for committing.
+    Args:
+        session: The database session to write with.
+        model: The SQLAlchemy model class for the table to update.
+        comment_ids: Ids of every row in the batch.
+        rows: List of result dicts, each holding an `id` and the column values to set.
+        defaults: Column values for the rows without a result.
+    Returns:
+        int: The number of rows written.
+    """
+    bulk_update(session, model, rows)
+
+    with_result = {row['id'] for row in rows}
+    remaining = [comment_id for comment_id in comment_ids if comment_id not in with_result]
+    if remaining:
+        session.execute(
+            update(model).where(model.id.in_(remaining)).values(defaults).execution_options(synchronize_session=False)
+        )
+
+    return len(comment_ids)
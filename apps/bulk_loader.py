@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+import time
+import migrations
+
+class CopyLoader:
+    """
+    Buffer cleaned comments and load them into a comment table with Postgres COPY.
+    Every `batch_size` rows are streamed in one COPY and committed.
+    Args:
+        session: The database session to load with.
+        model: The SQLAlchemy model class for the target table.
+        batch_size: The number of rows per COPY and commit.
+        forum_name: Forum name stored with every row, for tables that have the column.
+    """
+
+    def __init__(self, session, model, batch_size=50000, forum_name=None):
+        self.session = session
+        self.model = model
+        self.batch_size = batch_size
+        self.forum_name = forum_name
+        self.has_forum_name = 'forum_name' in model.__table__.c
+        self.rows = []
+        self.loaded = 0
+
+        # The detection flags only have Python-side defaults, so COPY has to set them explicitly
+        self.columns = ['post_date', 'comment', 'has_detection', 'has_detection_cc']
+        if self.has_forum_name:
+            self.columns.insert(0, 'forum_name')
+
+    def add(self, post_date, comment):
+        # `comment` is JSONB, so the text is stored as a JSON string like the ORM does
+        row = [post_date, json.dumps(comment), False, False]
+        if self.has_forum_name:
+            row.insert(0, self.forum_name)
+        self.rows.append(row)
+
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+
+        start = time.perf_counter()
+        # New years get their partition before COPY, instead of landing in the default partition
+        date_index = self.columns.index('post_date')
+        migrations.ensure_year_partitions(self.session, self.model.__tablename__, {row[date_index] for row in self.rows})
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(self.rows)
+        buffer.seek(0)
+
+        cursor = self.session.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY {self.model.__tablename__} ({', '.join(self.columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+        self.session.commit()
+
+        elapsed = time.perf_counter() - start
+        rate = len(self.rows) / elapsed if elapsed > 0 else float('inf')
+        print(f"Copied {len(self.rows)} rows into {self.model.__tablename__} ({rate:.0f} rows/s).")
+        self.loaded += len(self.rows)
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.flush()
@@ -1,17 +1,13 @@
-import spacy
 import json
 from tqdm import tqdm
-import multiprocessing
-import database
-import models
+import pipeline
+import batch_io
 import logging
+from keyword_matcher import KeywordMatcher
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Load the transformer-based spaCy English language model
-nlp = spacy.load('en_core_web_sm')
-
 patterns = { 
     "gender_identity_social_justice_keywords": [
         "gender fluidity", "non binary", "gender spectrum", "cisgender", 
@@ -38,124 +34,101 @@ patterns = {
     ]
 }
 
-def analyse_comment_spacy(comment):
-    doc = nlp(comment)
-    detected_patterns = set()
-    text = doc.text.lower()
+# Stored with every processed row; bump it whenever `patterns` or the matching rules change,
+# and the next run reprocesses every row analysed by an older version
+RULESET_VERSION = 1
+
+# Written to rows with nothing to analyse, so they are not picked up again
+NO_RESULT = {'construct_patterns': None, 'has_detection_cc': False, 'detection_cc_version': RULESET_VERSION}
+
+# The keyword automaton, compiled once per process by `get_matcher`
+matcher = None
 
-    # Check for patterns based on exact matches
-    for pattern_category, keywords in patterns.items():
-        for keyword in keywords:
-            keyword_pattern = keyword.lower()
-            if keyword_pattern in text:
-                detected_patterns.add(keyword)
-                print(f"Pattern Detected: {keyword}")  # Debugging print statement
+def get_matcher():
+    # Compile every category into a single automaton; also used as the worker pool
+    # initializer so each worker builds it once before taking tasks
+    global matcher
+    if matcher is None:
+        matcher = KeywordMatcher(patterns)
+    return matcher
 
-    return list(detected_patterns)
+def analyse_comment(comment):
+    detected_patterns = []
+
+    # One linear pass over the comment finds the keywords of every category
+    for pattern_category, keyword in get_matcher().find(comment):
+        if keyword not in detected_patterns:
+            detected_patterns.append(keyword)
+            logging.debug(f"Pattern Detected: {keyword} ({pattern_category})")
+
+    return detected_patterns
 
 def process_comment(item):
-    comment_text = item.comment.strip()
+    comment_id, comment_text = item
+    comment_text = comment_text.strip()
 
     if not comment_text:
         return None
 
-    detected_patterns = analyse_comment_spacy(comment_text)
-    print(f"Detected patterns for comment {item.id}: {detected_patterns}")  # Debugging print statement
+    detected_patterns = analyse_comment(comment_text)
+    logging.debug(f"Detected patterns for comment {comment_id}: {detected_patterns}")
+
+    return build_result(comment_id, detected_patterns)
 
+def build_result(comment_id, detected_patterns):
     if detected_patterns:
         return {
-            'id': item.id,
-            'post_date': item.post_date,
-            'comment': comment_text,
+            'id': comment_id,
             'construct_patterns': json.dumps(detected_patterns),
-            'has_detection_cc': True  
+            'has_detection_cc': True,
+            'detection_cc_version': RULESET_VERSION
         }
     else:
         return {
-            'id': item.id,
-            'post_date': item.post_date,
-            'comment': comment_text,
+            'id': comment_id,
             'construct_patterns': json.dumps([]), 
-            'has_detection_cc': False  
+            'has_detection_cc': False,
+            'detection_cc_version': RULESET_VERSION
         }
 
-def process_comments_multiprocessing(comments):
-    results = []
+def create_pool(num_cores):
+    # Every worker compiles the automaton once up front
+    return pipeline.spawn_pool(num_cores, get_matcher)
 
-    num_cores = 10  # Use 10 CPU cores
+def process_comments_multiprocessing(comments, pool, chunksize=500):
+    results = []
 
-    with multiprocessing.Pool(processes=num_cores) as pool:
-        iterator = pool.imap(process_comment, comments)
+    # Send the (id, text) tuples to the workers in chunks
+    iterator = pool.imap(process_comment, comments, chunksize=chunksize)
 
-        with tqdm(total=len(comments), desc='Processing comments', unit=' comments') as pbar:
-            for result in iterator:
-                if result:
-                    results.append(result)
-                pbar.update(1)
+    with tqdm(total=len(comments), desc='Processing comments', unit=' comments') as pbar:
+        for result in iterator:
+            if result:
+                results.append(result)
+            pbar.update(1)
 
     return results
 
-def process_data_from_db(table_name, batch_size=10000):  
-    session = database.create_session()
+def process_data_from_db(table_name, batch_size=10000, num_cores=10, chunksize=500, collapse_near_duplicates=False,
+                         queue_size=2):  
+    # Start the workers before the session exists so they do not inherit its connection
+    pool = create_pool(num_cores)
 
-    try:
-        if table_name == 'test':
-            model = models.Test
-        elif table_name == 'usenet':
-            model = models.Usenet
-        elif table_name == 'reddit':
-            model = models.Reddit
-        else:
-            raise ValueError("Invalid table name. Choose 'test', 'usenet', or 'reddit'.")
-
-        total_comments = session.query(model).count()
-        logging.info(f"Processing {total_comments} comments from {table_name} table.")
-
-        for offset in range(0, total_comments, batch_size):
-            comments = session.query(model).offset(offset).limit(batch_size).all()
-            logging.info(f"Processing comments from offset {offset} to {offset + batch_size}")
-
-            if not comments:
-                logging.info("No comments fetched for the current batch.")
-                continue
-
-            try:
-                processed_data = process_comments_multiprocessing(comments)
-                logging.info(f"Processed {len(processed_data)} comments.")
-            except Exception as e:
-                logging.error(f"Error in processing comments: {str(e)}")
-                continue
-
-            for item in processed_data:
-                record = session.query(model).filter_by(id=item['id']).first()
-                if record:
-                    print(f"Before update - ID: {record.id}, Patterns: {record.construct_patterns}")  # Debugging print statement
-                    record.construct_patterns = item['construct_patterns']
-                    record.has_detection_cc = item['has_detection_cc']
-                    session.add(record)
-                    print(f"After update - ID: {record.id}, Patterns: {record.construct_patterns}")  # Debugging print statement
-
-            try:
-                session.commit()
-                logging.info(f"Committed changes for offset {offset}")
-
-                # Verify the update
-                for item in processed_data:
-                    record = session.query(model).filter_by(id=item['id']).first()
-                    print(f"Verified update - ID: {record.id}, Patterns: {record.construct_patterns}")  # Debugging print statement
-
-            except Exception as e:
-                logging.error(f"Error during commit: {str(e)}")
-                session.rollback()
-                continue
-
-    except Exception as e:
-        logging.error(f"Error occurred: {str(e)}")
+    model = batch_io.get_model(table_name)
 
-    finally:
-        database.close_session(session)
+    def process_rows(rows):
+        return process_comments_multiprocessing([(row.id, row.comment) for row in rows], pool, chunksize)
 
-    logging.info(f"Processing complete. Updated records in {table_name} table.")
+    try:
+        # Only rows not yet analysed by the current ruleset
+        pipeline.process_table(
+            model, [batch_io.needs_processing(model.detection_cc_version, RULESET_VERSION)], process_rows,
+            [('detection_cc_version', RULESET_VERSION, list(NO_RESULT))], NO_RESULT, batch_size=batch_size,
+            collapse_near_duplicates=collapse_near_duplicates, queue_size=queue_size
+        )
+    finally:
+        pool.close()
+        pool.join()
 
 if __name__ == '__main__':
     table_name = 'reddit'  # Change this to 'usenet' or 'reddit' as needed
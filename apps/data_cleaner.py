@@ -1,48 +1,24 @@
 import os
-import json
-import string
-import re
+import argparse
 import nltk
-import contractions
-from nltk.tokenize import word_tokenize
+from functools import partial
 from tqdm import tqdm
 from datetime import datetime, timezone
+import json_stream
+import parallel_ingest
+import dedup
+import text_cleaning
+from text_cleaning import clean_texts
 
-nltk.download('punkt')
 nltk.download('stopwords')
 
-def clean_text(text):
-    cleaning_rules = [
-        (r"http[s]?://[^\s]+", ""),  # Remove URLs
-        (r"\b\w*\.\w+\b", ""),  # Remove words with periods
-        (r"\b\w*[-–—]+\w*\b", ""),  # Remove words with hyphens and dashes
-        (r"\s+", " "),  # Remove repeated spaces
-        (r"[^a-zA-Z\s]", ""),  # Keep only alphabetic characters and spaces
-    ]
-    
-    # Apply cleaning rules
-    for pattern, replacement in cleaning_rules:
-        text = re.sub(pattern, replacement, text)
-    
-    text = text.lower()
-    text = contractions.fix(text)
-    text = text.translate(str.maketrans('', '', string.punctuation))
-    words = word_tokenize(text)
-    return ' '.join(words)
-
-
 def convert_utc_to_date(utc_timestamp):
     return datetime.fromtimestamp(int(utc_timestamp), tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
-def process_file(input_file, output_dir):
-    print(f"Processing file: {input_file}")
-    with open(input_file, 'r') as file:
-        data = json.load(file)
+def clean_batch(batch, dedup_store, origin, first_position=0, tokenizer='regex'):
+    entries = []
 
-    cleaned_data = []
-    seen_comments = set()
-
-    for i, item in enumerate(tqdm(data, desc="Cleaning comments", unit="comment")):
+    for position, item in enumerate(batch, first_position):
         if 'comment' in item and 'date' in item:
             # Usenet data structure
             body = item.get('comment', '')
@@ -55,34 +31,76 @@ def process_file(input_file, output_dir):
             continue  # Skip if no recognizable comment and date fields found
 
         # Skip deleted or removed comments
-        if body in ['[deleted]', '[removed]'] or body in seen_comments:
+        if body in ['[deleted]', '[removed]']:
             continue
 
-        # Clean the comment text
-        cleaned_body = clean_text(body)
+        entries.append((body, date, position))
+
+    # Clean the comment texts of the whole batch at once
+    cleaned_bodies = clean_texts([body for body, _, _ in entries], tokenizer)
 
-        if cleaned_body:
-            cleaned_data.append({'date': date, 'comment': cleaned_body})
-            seen_comments.add(body)
+    kept = [(date, cleaned_body, position)
+            for (_, date, position), cleaned_body in zip(entries, cleaned_bodies) if cleaned_body]
+
+    # Comments already kept from any other file or source are dropped
+    is_new = dedup_store.filter_new([cleaned_body for _, cleaned_body, _ in kept], origin,
+                                    [position for _, _, position in kept])
+    return [{'date': date, 'comment': cleaned_body} for (date, cleaned_body, _), new in zip(kept, is_new) if new]
+
+def process_file(input_file, output_dir, batch_size=10000, dedup_path=dedup.DEFAULT_DEDUP_PATH, tokenizer='regex'):
+    print(f"Processing file: {input_file}")
 
     filename = os.path.basename(input_file)
     output_file = os.path.join(output_dir, f"cleaned_{filename}")
-    with open(output_file, 'w') as cleaned_file:
-        json.dump(cleaned_data, cleaned_file, indent=4)
 
-def main():
+    # Read, clean and write the file one bounded batch at a time
+    records = tqdm(json_stream.iter_records(input_file), desc="Cleaning comments", unit="comment")
+    with dedup.DedupStore(dedup_path) as dedup_store:
+        with open(output_file, 'w') as cleaned_file, json_stream.JsonArrayWriter(cleaned_file) as writer:
+            position = 0
+            for batch in json_stream.batched(records, batch_size):
+                for entry in clean_batch(batch, dedup_store, filename, position, tokenizer):
+                    writer.write(entry)
+                position += len(batch)
+
+        # Only a complete output file counts its comments as kept
+        dedup_store.commit()
+
+def iter_comment_texts(json_files):
+    # The raw comment texts `clean_batch` would clean, file by file
+    for input_file in json_files:
+        for item in json_stream.iter_records(input_file):
+            body = item.get('comment', item.get('body', ''))
+            if body not in ['[deleted]', '[removed]']:
+                yield body
+
+def main(workers=None, dedup_path=dedup.DEFAULT_DEDUP_PATH, reset_dedup=False, tokenizer='regex',
+         verify_tokenizer=None):
     input_dir = "/home/joe/diss_project/data/usenet/extracted"
     output_dir = "/home/joe/diss_project/data/usenet/cleaned"
 
-    json_files = [os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.endswith(".json")]
+    json_files = parallel_ingest.list_input_files(input_dir)
 
     print(f"Found {len(json_files)} JSON files to process.")
 
-    for filename in tqdm(json_files, desc="Processing files", unit="file"):
-        process_file(filename, output_dir)
+    if verify_tokenizer:
+        text_cleaning.check_tokenizer(iter_comment_texts(json_files), tokenizer, verify_tokenizer)
+        return
+
+    if reset_dedup:
+        dedup.reset(dedup_path)
+
+    # Each file is cleaned independently into its own cleaned_<name> output
+    parallel_ingest.run_parallel(partial(process_file, output_dir=output_dir, dedup_path=dedup_path,
+                                         tokenizer=tokenizer), json_files, workers)
 
     print("Data cleaning complete. Cleaned files are saved in the output directory.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Clean the Usenet JSON dumps into cleaned_<name>.json files.")
+    parser.add_argument('--workers', type=int, help="Number of worker processes; defaults to the CPU count.")
+    dedup.add_arguments(parser)
+    text_cleaning.add_arguments(parser)
+    args = parser.parse_args()
+    main(args.workers, args.dedup_path, args.reset_dedup, args.tokenizer, args.verify_tokenizer)
 
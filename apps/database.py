@@ -1,24 +1,83 @@
+import os
+from contextlib import contextmanager
 from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-def create_session():
-    # Create an engine to connect to a PostgreSQL database
-    engine = create_engine('postgresql://joe@/diss', echo=True)
-    
-    # Create a base class for declarative class definitions
-    Base = declarative_base()
+# Connection settings, each overridable from the environment
+DEFAULT_DATABASE_URL = 'postgresql://joe@/diss'
 
-    # Create the tables in the database
-    Base.metadata.create_all(engine)
+# One engine (and its connection pool) per database URL, shared by the whole process
+_engines = {}
+_session_makers = {}
+_engines_pid = None
 
-    # Create a session maker bound to the engine
-    Session = sessionmaker(bind=engine)
-    
-    # Return a session object
-    return Session()
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def get_database_url():
+    return os.environ.get('DISS_DATABASE_URL', DEFAULT_DATABASE_URL)
+
+def get_engine(url=None):
+    """
+    Return the process-wide engine for a database URL, creating it on first use.
+    Pool size, overflow, pre-ping and statement echo come from DISS_DB_POOL_SIZE,
+    DISS_DB_MAX_OVERFLOW, DISS_DB_PRE_PING and DISS_DB_ECHO.
+    Args:
+        url: The database URL; defaults to DISS_DATABASE_URL or the local `diss` database.
+    Returns:
+        sqlalchemy.engine.Engine: The shared engine.
+    """
+    global _engines_pid
+    url = url or get_database_url()
+
+    # A forked worker must not reuse the pooled connections of its parent
+    if _engines_pid != os.getpid():
+        for engine in _engines.values():
+            engine.dispose(close=False)
+        _engines.clear()
+        _session_makers.clear()
+        _engines_pid = os.getpid()
+
+    if url not in _engines:
+        _engines[url] = create_engine(
+            url,
+            pool_size=int(os.environ.get('DISS_DB_POOL_SIZE', 5)),
+            max_overflow=int(os.environ.get('DISS_DB_MAX_OVERFLOW', 10)),
+            pool_pre_ping=_env_flag('DISS_DB_PRE_PING', True),
+            echo=_env_flag('DISS_DB_ECHO', False),
+        )
+        _session_makers[url] = sessionmaker(bind=_engines[url])
+
+    return _engines[url]
+
+def create_session(url=None):
+    # Create a session bound to the shared engine
+    url = url or get_database_url()
+    get_engine(url)
+    return _session_makers[url]()
 
 def close_session(session):
     # Close the session
     session.close()
 
+@contextmanager
+def session_scope(url=None):
+    """
+    Provide a session that is committed on success, rolled back on error and always closed.
+    Args:
+        url: The database URL; defaults to DISS_DATABASE_URL or the local `diss` database.
+    Yields:
+        sqlalchemy.orm.Session: The session.
+    """
+    session = create_session(url)
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        close_session(session)
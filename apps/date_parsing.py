@@ -0,0 +1,123 @@
+import re
+import time
+from functools import lru_cache
+from datetime import datetime
+from dateutil import parser as date_parser
+from dateutil import tz
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+# RFC 822 style dates as found in Usenet headers, e.g. "Mon, 12 Mar 2001 14:22:11 -0500 (EST)".
+# Only four digit years from 100 on; smaller years get dateutil's century rules.
+RFC822_DATE = re.compile(
+    r"^\s*(?:(?:mon(?:day)?|tue(?:sday)?|wed(?:nesday)?|thu(?:rsday)?|fri(?:day)?|sat(?:urday)?|sun(?:day)?),?\s+)?"
+    r"(?P<day>\d{1,2})\s+"
+    r"(?P<month>jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\s+"
+    r"(?P<year>\d{4})\s+"
+    r"(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?"
+    r"(?:\s+(?:(?P<sign>[+-])(?P<offset_hours>\d{2})(?P<offset_minutes>\d{2})(?:\s+\((?P<comment>[A-Za-z]+)\))?"
+    r"|(?P<zone>[A-Za-z]+)))?\s*$",
+    re.IGNORECASE
+)
+
+# Zone names dateutil maps to UTC itself
+UTC_NAMES = {'UTC', 'GMT', 'Z', 'UT'}
+ZONE_COMMENT = re.compile(r"^[A-Z]{3,5}$")
+
+class DateNormalizer:
+    """
+    Parse Usenet post dates to datetimes with the same result as `dateutil.parser.parse`.
+    Common RFC 822 layouts go through a compiled pattern, repeated strings are answered from
+    a bounded cache, and anything else falls back to dateutil.
+    Offsets beyond +/-14 hours, which the database rejects, are normalized to UTC.
+    Args:
+        cache_size: The maximum number of distinct date strings kept in the cache.
+    """
+
+    def __init__(self, cache_size=100000):
+        self.counts = {'fast': 0, 'fallback': 0, 'failed': 0}
+        # dateutil resolves the local zone's names to tzlocal(), whatever offset accompanies them
+        self.local_names = set(time.tzname)
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize)
+
+    def _fast_parse(self, date_str):
+        match = RFC822_DATE.match(date_str)
+        if not match:
+            return None
+
+        if int(match['year']) < 100:
+            return None
+
+        zone = match['zone']
+        comment = match['comment']
+        if match['sign']:
+            # dateutil only reads a 3 to 5 capital letter name in parentheses, and reads UTC names as UTC
+            if comment and (not ZONE_COMMENT.match(comment) or comment in UTC_NAMES or comment in self.local_names):
+                return None
+            offset = int(match['offset_hours']) * 3600 + int(match['offset_minutes']) * 60
+            if match['sign'] == '-':
+                offset = -offset
+            tzinfo = tz.tzoffset(comment, offset) if offset else tz.UTC
+        elif zone:
+            # Any other name is a named zone or unknown to dateutil; leave it to dateutil
+            if zone in self.local_names or zone not in UTC_NAMES - {'UT'}:
+                return None
+            tzinfo = tz.UTC
+        else:
+            tzinfo = None
+
+        return datetime(
+            int(match['year']), MONTHS[match['month'][:3].lower()], int(match['day']),
+            int(match['hour']), int(match['minute']), int(match['second'] or 0),
+            tzinfo=tzinfo
+        )
+
+    def parse(self, date_str):
+        """
+        Parse a date string without the cache.
+        Args:
+            date_str: The raw date string.
+        Returns:
+            datetime: The parsed date.
+        Raises:
+            ValueError or OverflowError: If dateutil cannot parse it either.
+        """
+        try:
+            post_date = self._fast_parse(date_str)
+        except ValueError:
+            # Out of range fields; dateutil decides whether the string is usable
+            post_date = None
+
+        if post_date is not None:
+            self.counts['fast'] += 1
+            return post_date
+
+        self.counts['fallback'] += 1
+        return date_parser.parse(date_str)
+
+    def _normalize(self, date_str):
+        try:
+            post_date = self.parse(date_str)
+            # Offsets of a day or more make `utcoffset` raise, which counts as a failure too
+            if post_date.utcoffset() is not None:
+                # Check if timezone offset is within supported range
+                offset_hours = post_date.utcoffset().total_seconds() / 3600
+                if abs(offset_hours) > 14:
+                    print(f"Invalid timezone offset in date '{date_str}', normalizing to UTC")
+                    post_date = post_date.astimezone(tz.UTC)
+        except (ValueError, OverflowError) as e:
+            print(f"Failed to parse date '{date_str}': {e}")
+            self.counts['failed'] += 1
+            return None
+
+        return post_date
+
+    def report(self):
+        cache = self.normalize.cache_info()
+        total = cache.hits + cache.misses
+        print(f"Dates: {total} parsed, {cache.hits} from the cache, {self.counts['fast']} by the RFC 822 parser, "
+              f"{self.counts['fallback']} by dateutil ({self.counts['failed']} failed).")
@@ -0,0 +1,289 @@
+import os
+import math
+import fcntl
+import struct
+import sqlite3
+import hashlib
+
+# Shared by every cleaner and run, so crossposts between files and sources are caught;
+# `reset` or --reset-dedup starts over
+DEFAULT_DEDUP_PATH = os.environ.get('DISS_DEDUP_PATH', 'dedup.sqlite')
+
+DIGEST_SIZE = 16
+BLOOM_MAGIC = b'DBL2'
+# Magic, filter shape and the last `kept` row the filter holds
+BLOOM_HEADER = struct.Struct('>4sQIQ')
+# Layout of the index; older ones are converted on open
+SCHEMA_VERSION = 2
+
+def digest(text):
+    # Fixed-size key for a comment, whatever its length
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over content digests. Its memory does not grow with the number
+    of digests added; only its false positive rate does.
+    Args:
+        capacity: The number of digests it is sized for.
+        error_rate: The false positive rate at `capacity` digests.
+    """
+
+    def __init__(self, capacity=20_000_000, error_rate=0.01):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key):
+        # The digest is already uniformly distributed, so its two halves serve as the base hashes
+        h1, h2 = struct.unpack('>QQ', key)
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def header(self, last_seq):
+        return BLOOM_HEADER.pack(BLOOM_MAGIC, self.num_bits, self.num_hashes, last_seq)
+
+    def read_header(self, data):
+        # The last `kept` row of a saved filter of the same shape, or None for any other file
+        if len(data) != BLOOM_HEADER.size:
+            return None
+        magic, num_bits, num_hashes, last_seq = BLOOM_HEADER.unpack(data)
+        if (magic, num_bits, num_hashes) != (BLOOM_MAGIC, self.num_bits, self.num_hashes):
+            return None
+        return last_seq
+
+    def merge(self, data):
+        # OR in the bits of a filter with the same shape; anything else is ignored
+        if len(data) != len(self.bits):
+            return
+        merged = int.from_bytes(self.bits, 'big') | int.from_bytes(data, 'big')
+        self.bits = bytearray(merged.to_bytes(len(self.bits), 'big'))
+
+def reset(path=DEFAULT_DEDUP_PATH):
+    # Forget every comment recorded so far, index and filter alike
+    for suffix in ('', '-wal', '-shm', '.bloom'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def add_arguments(parser):
+    parser.add_argument('--dedup-path', default=DEFAULT_DEDUP_PATH,
+                        help="Path of the dedup index shared by the cleaners.")
+    parser.add_argument('--reset-dedup', action='store_true',
+                        help="Forget the comments recorded by earlier runs before starting.")
+
+class DedupStore:
+    """
+    Persistent set of the comments kept so far, shared across files, sources, runs and worker
+    processes. Each comment is recorded with its origin (the file or row group it was kept
+    from) and its position there, so running an origin again keeps the same comments as the
+    first time instead of finding all of them already seen.
+    Comments are checked with `filter_new` and only recorded by `commit`, which callers run
+    once the kept comments are durably written; a crash before that records nothing. Until
+    then they wait in a temporary table, so memory does not grow with the size of an origin.
+    Digests live in an on-disk SQLite index; a Bloom filter in front of it answers most lookups
+    for new comments without touching the disk. Every `kept` row has an increasing sequence
+    number, and each check first adds the rows other stores committed since the last one, so
+    a comment committed by any process is never a Bloom negative. The filter is saved next to
+    the index with the last row it holds and merged with other processes' filters on close.
+    Two workers that reach the same comment before either commits both keep it.
+    Args:
+        path: Path of the SQLite index; the filter is kept at `path + '.bloom'`.
+        capacity: The number of digests the filter is sized for.
+        error_rate: The filter's false positive rate at `capacity` digests.
+    """
+
+    def __init__(self, path=DEFAULT_DEDUP_PATH, capacity=20_000_000, error_rate=0.01):
+        self.path = path
+        self.bloom_path = path + '.bloom'
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.stats = {'checked': 0, 'duplicates': 0, 'bloom_negatives': 0, 'bloom_false_positives': 0}
+        self.origins = {}
+        # The last `kept` row added to the filter
+        self.last_seq = 0
+
+        # Autocommit mode, so transactions are opened explicitly around each write
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+        # Comments kept since the last commit; private to this connection and gone with it
+        self.connection.execute(
+            "CREATE TEMP TABLE pending ("
+            "digest BLOB PRIMARY KEY, origin INTEGER NOT NULL, position INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self._load_bloom()
+        self._refresh_bloom()
+
+    def _create_tables(self):
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("CREATE TABLE IF NOT EXISTS origins (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+            if cursor.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                # Version 1 had no sequence numbers; its rows are renumbered in digest order
+                old_layout = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'kept'").fetchone()
+                if old_layout:
+                    cursor.execute("ALTER TABLE kept RENAME TO kept_v1")
+                cursor.execute(
+                    "CREATE TABLE kept (seq INTEGER PRIMARY KEY, digest BLOB NOT NULL UNIQUE, "
+                    "origin INTEGER NOT NULL, position INTEGER NOT NULL)"
+                )
+                if old_layout:
+                    cursor.execute("INSERT INTO kept (digest, origin, position) SELECT digest, origin, position FROM kept_v1")
+                    cursor.execute("DROP TABLE kept_v1")
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def _load_bloom(self):
+        if not os.path.exists(self.bloom_path):
+            return
+        with open(self.bloom_path, 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            last_seq = self.bloom.read_header(f.read(BLOOM_HEADER.size))
+            if last_seq is not None:
+                self.bloom.merge(f.read())
+                self.last_seq = last_seq
+
+    def _refresh_bloom(self):
+        # Rows are numbered in commit order, so everything past `last_seq` is new to the filter
+        rows = self.connection.execute("SELECT seq, digest FROM kept WHERE seq > ? ORDER BY seq", (self.last_seq,))
+        for seq, key in rows:
+            self.bloom.add(key)
+            self.last_seq = seq
+
+    def _save_bloom(self):
+        with open(self.bloom_path, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            last_seq = self.bloom.read_header(f.read(BLOOM_HEADER.size))
+            if last_seq is not None:
+                # Each filter holds every row up to its own mark, so their union holds every row up to the larger
+                self.bloom.merge(f.read())
+                self.last_seq = max(self.last_seq, last_seq)
+            f.seek(0)
+            f.truncate()
+            f.write(self.bloom.header(self.last_seq))
+            f.write(self.bloom.bits)
+
+    def _origin_id(self, origin):
+        if origin not in self.origins:
+            self.connection.execute("INSERT OR IGNORE INTO origins (name) VALUES (?)", (origin,))
+            row = self.connection.execute("SELECT id FROM origins WHERE name = ?", (origin,)).fetchone()
+            self.origins[origin] = row[0]
+        return self.origins[origin]
+
+    def filter_new(self, texts, origin, positions):
+        """
+        Check a batch of comments against every comment kept so far, by this run or earlier ones.
+        A comment is new unless it was kept from another origin, or from an earlier position
+        of this one. New comments are held until `commit`.
+        Args:
+            texts: List of comment texts.
+            origin: Name of the file or row group the comments come from, stable across runs.
+            positions: Position of each comment in its origin, increasing.
+        Returns:
+            list of bool: True for each text to keep, in the same order as `texts`.
+        """
+        origin_id = self._origin_id(origin)
+        keys = [digest(text) for text in texts]
+        self._refresh_bloom()
+
+        unique_keys = list(dict.fromkeys(keys))
+        pending = {key for key, in self._lookup("SELECT digest FROM pending", unique_keys)}
+
+        # A Bloom negative was never committed by any process; only positives need the index
+        unchecked = [key for key in unique_keys if key not in pending]
+        maybe_kept = [key for key in unchecked if key in self.bloom]
+        self.stats['bloom_negatives'] += len(unchecked) - len(maybe_kept)
+
+        kept = {key: (kept_origin, kept_position)
+                for key, kept_origin, kept_position in self._lookup("SELECT digest, origin, position FROM kept", maybe_kept)}
+        self.stats['bloom_false_positives'] += len(maybe_kept) - len(kept)
+
+        is_new = []
+        new_rows = []
+        for key, position in zip(keys, positions):
+            if key in pending:
+                new = False
+            elif key in kept:
+                kept_origin, kept_position = kept[key]
+                # The comment itself, kept by an earlier run of this origin, is kept again
+                new = kept_origin == origin_id and kept_position >= position
+            else:
+                new = True
+
+            if new:
+                pending.add(key)
+                new_rows.append((key, origin_id, position))
+            is_new.append(new)
+
+        # Only the temporary table is written, which takes no lock on the shared index
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN")
+        cursor.executemany("INSERT INTO pending (digest, origin, position) VALUES (?, ?, ?)", new_rows)
+        cursor.execute("COMMIT")
+
+        self.stats['checked'] += len(keys)
+        self.stats['duplicates'] += is_new.count(False)
+        return is_new
+
+    def _lookup(self, query, keys):
+        # Rows of `query` whose digest is one of `keys`, a few hundred keys per statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            yield from self.connection.execute(f"{query} WHERE digest IN ({placeholders})", chunk)
+
+    def commit(self):
+        """
+        Record the comments kept since the last commit. Call it once they are durably written,
+        e.g. after the database commit or once the output file is complete.
+        Returns:
+            int: The number of comments recorded.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have kept the same comment first; its record stays
+            recorded = cursor.execute(
+                "INSERT OR IGNORE INTO kept (digest, origin, position) "
+                "SELECT digest, origin, position FROM pending ORDER BY origin, position"
+            ).rowcount
+            cursor.execute("DELETE FROM pending")
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+
+        # The new rows reach the filter with everyone else's
+        self._refresh_bloom()
+        return recorded
+
+    def report(self):
+        checked = self.stats['checked']
+        hit_rate = self.stats['duplicates'] / checked if checked else 0.0
+        print(f"Dedup: {self.stats['duplicates']} of {checked} comments were duplicates ({hit_rate:.1%}); "
+              f"{self.stats['bloom_negatives']} answered by the Bloom filter, "
+              f"{self.stats['bloom_false_positives']} Bloom false positives.")
+
+    def close(self):
+        # Comments never committed are forgotten with the temporary table, so a failed write
+        # does not hide them from the next run
+        self._save_bloom()
+        self.connection.close()
+        self.report()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
@@ -0,0 +1,232 @@
+import logging
+from sqlalchemy import or_
+from tqdm import tqdm
+import pipeline
+import batch_io
+import nlp_pipeline
+import detection_cache
+import ob_sub_patterns
+import construct_concepts_patterns
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class Detector:
+    """
+    A detector the combined runner can apply to a comment.
+    Args:
+        name: Short name used in logs.
+        version_column: Name of the column holding the ruleset version that last processed a row.
+        version: The current ruleset version.
+        defaults: Column values written when the detector finds nothing.
+        analyse: Function taking (comment id, text, spaCy doc or None) and returning a result
+            dict like `defaults` plus the `id`, or None when nothing is found. Pool workers
+            get it by reference, so it must be a module-level function, as must `needs_doc`.
+        needs_doc: Optional function taking the text and telling whether `analyse` needs its
+            spaCy parse; detectors without one never get a doc.
+        cached: Whether results are kept in the detection cache; worth it only for detectors
+            slower than a cache lookup.
+    """
+
+    def __init__(self, name, version_column, version, defaults, analyse, needs_doc=None, cached=False):
+        self.name = name
+        self.version_column = version_column
+        self.version = version
+        self.defaults = defaults
+        self.analyse = analyse
+        self.needs_doc = needs_doc
+        self.cached = cached
+
+    @property
+    def columns(self):
+        return list(self.defaults)
+
+    def is_stale(self, stored_version):
+        return stored_version is None or stored_version < self.version
+
+def analyse_ob_sub(comment_id, text, doc):
+    # Comments the prefilter ruled out are never parsed and cannot match
+    if doc is None:
+        return None
+    objective_patterns, possessive_patterns, subjective_patterns = ob_sub_patterns.analyse_doc(doc)
+    return ob_sub_patterns.build_result(comment_id, objective_patterns, possessive_patterns, subjective_patterns)
+
+def analyse_construct(comment_id, text, doc):
+    return construct_concepts_patterns.build_result(comment_id, construct_concepts_patterns.analyse_comment(text))
+
+# Every detector run by `process_data_from_db`, in the order they are applied
+DETECTORS = [
+    Detector('ob_sub', 'detection_version', ob_sub_patterns.RULESET_VERSION, ob_sub_patterns.NO_DETECTION,
+             analyse_ob_sub, needs_doc=ob_sub_patterns.might_contain_truth, cached=True),
+    Detector('construct', 'detection_cc_version', construct_concepts_patterns.RULESET_VERSION,
+             construct_concepts_patterns.NO_RESULT, analyse_construct),
+]
+
+# Per-process state of pool workers, set by `init_worker`
+worker_detectors = []
+worker_options = {}
+
+def init_worker(detectors, nlp_batch_size=1000):
+    # Pool initializer: keep the run's detectors and warm up the spaCy model if any of them parses
+    worker_detectors[:] = detectors
+    worker_options.update(nlp_batch_size=nlp_batch_size)
+    if any(d.needs_doc for d in detectors):
+        ob_sub_patterns.get_nlp()
+
+def create_pool(detectors, n_process, nlp_batch_size=1000):
+    # Every worker keeps the run's detectors and loads spaCy once if any of them parses
+    return pipeline.spawn_pool(n_process, init_worker, (detectors, nlp_batch_size))
+
+def analyse_texts(tasks, detectors, nlp_batch_size=1000):
+    """
+    Run detectors on distinct comment texts in this process, parsing each text with spaCy at most once.
+    Args:
+        tasks: List of (text, names of the detectors to run on it).
+        detectors: The detectors the names refer to.
+        nlp_batch_size: The number of texts per `nlp.pipe` batch.
+    Returns:
+        list of dicts: Per task, the result of each detector run on it, without the row `id`,
+        as stored in the detection cache.
+    """
+    by_name = {d.name: d for d in detectors}
+    to_parse = [
+        (text, index) for index, (text, names) in enumerate(tasks)
+        if any(by_name[name].needs_doc and by_name[name].needs_doc(text) for name in names)
+    ]
+
+    docs = {}
+    if to_parse:
+        for doc, index in nlp_pipeline.pipe_comments(ob_sub_patterns.get_nlp(), to_parse, batch_size=nlp_batch_size):
+            docs[index] = doc
+
+    return [
+        {name: detection_cache.to_cached(by_name[name].analyse(None, text, docs.get(index))) for name in names}
+        for index, (text, names) in enumerate(tasks)
+    ]
+
+def analyse_chunk(tasks):
+    # Pool task: one chunk of texts, analysed with this worker's detectors and model
+    return analyse_texts(tasks, worker_detectors, **worker_options)
+
+def detect_batch(rows, detectors, nlp_batch_size=1000, pool=None, caches=None, chunksize=500):
+    """
+    Run every stale detector on a batch of rows, analysing each distinct text at most once.
+    Args:
+        rows: Rows holding `id`, `comment` and each detector's version column.
+        detectors: The detectors to apply.
+        nlp_batch_size: The number of texts per `nlp.pipe` batch.
+        pool: Optional pool from `create_pool` to spread the texts over; None analyses in-process.
+        caches: Optional mapping of detector name to its DetectionCache.
+        chunksize: The number of texts per pool task.
+    Returns:
+        list of dicts: One per row, merging the columns of every detector that ran on it.
+    """
+    caches = caches or {}
+    texts = {}
+    stale = {}
+    for row in rows:
+        texts[row.id] = (row.comment or '').strip()
+        stale[row.id] = [d for d in detectors if d.is_stale(getattr(row, d.version_column))]
+
+    # Text analysed before, by any run, is answered from the cache without analysis or parsing
+    cached = {}
+    for name, cache in caches.items():
+        cached[name] = cache.get_many(
+            texts[row.id] for row in rows if texts[row.id] and any(d.name == name for d in stale[row.id])
+        )
+
+    # Each distinct text is analysed once, however many rows share it
+    work = {}
+    for row in rows:
+        text = texts[row.id]
+        if not text:
+            continue
+        names = work.setdefault(text, [])
+        for detector in stale[row.id]:
+            if text not in cached.get(detector.name, {}) and detector.name not in names:
+                names.append(detector.name)
+    tasks = [(text, names) for text, names in work.items() if names]
+
+    logging.info(f"Analysing {len(tasks)} distinct texts of {len(rows)} comments.")
+    if pool is None:
+        analysed = analyse_texts(tasks, detectors, nlp_batch_size)
+    else:
+        chunks = [tasks[start:start + chunksize] for start in range(0, len(tasks), chunksize)]
+        analysed = []
+        for chunk_results in tqdm(pool.imap(analyse_chunk, chunks), total=len(chunks), desc='Analysing comments', unit=' chunks'):
+            analysed.extend(chunk_results)
+    fresh = {text: values for (text, _), values in zip(tasks, analysed)}
+
+    results = []
+    new_entries = {name: {} for name in caches}
+    for row in rows:
+        text = texts[row.id]
+        merged = {'id': row.id}
+        for detector in stale[row.id]:
+            if not text:
+                result = None
+            elif text in cached.get(detector.name, {}):
+                result = detection_cache.from_cached(row.id, cached[detector.name][text])
+            else:
+                value = fresh[text][detector.name]
+                result = detection_cache.from_cached(row.id, value)
+                if detector.name in caches:
+                    new_entries[detector.name][text] = value
+            merged.update(result if result else detector.defaults)
+        results.append(merged)
+
+    for name, entries in new_entries.items():
+        if entries:
+            caches[name].put_many(entries)
+
+    return results
+
+def process_data_from_db(table_name, batch_size=10000, nlp_batch_size=1000, n_process=1, collapse_near_duplicates=False,
+                         detectors=None, cache_path=detection_cache.DEFAULT_CACHE_PATH, queue_size=2):
+    """
+    Run every registered detector over a table in one pass: each row is read once, parsed once,
+    and all its result columns are written back in a single UPDATE per batch.
+    Args:
+        table_name: The table to process, 'test', 'usenet' or 'reddit'.
+        batch_size: The number of rows read and written per batch.
+        nlp_batch_size: The number of texts per `nlp.pipe` batch.
+        n_process: The number of worker processes the analysis is spread over; 1 analyses in-process.
+        collapse_near_duplicates: Whether to analyse only cluster representatives and copy
+            their results to the rest of each cluster.
+        detectors: The detectors to run; defaults to DETECTORS.
+        cache_path: Path of the shared detection cache; None disables caching.
+        queue_size: The maximum number of batches waiting to be processed or written.
+    """
+    detectors = detectors or DETECTORS
+    # The workers are started before the pipeline's threads and sessions exist
+    pool = create_pool(detectors, n_process, nlp_batch_size) if n_process > 1 else None
+    caches = {}
+    if cache_path:
+        caches = {d.name: detection_cache.DetectionCache(d.name, d.version, cache_path) for d in detectors if d.cached}
+
+    model = batch_io.get_model(table_name)
+
+    # Rows that at least one detector has not processed with its current ruleset
+    version_columns = [getattr(model, d.version_column) for d in detectors]
+    criteria = [or_(*(batch_io.needs_processing(column, d.version) for column, d in zip(version_columns, detectors)))]
+
+    def process_rows(rows):
+        return detect_batch(rows, detectors, nlp_batch_size, pool, caches)
+
+    try:
+        # Every row gets a result merging the columns of each detector that ran on it
+        pipeline.process_table(
+            model, criteria, process_rows, [(d.version_column, d.version, d.columns) for d in detectors],
+            columns=[model.id, model.comment, *version_columns], batch_size=batch_size,
+            collapse_near_duplicates=collapse_near_duplicates, queue_size=queue_size,
+            description=', '.join(d.name for d in detectors)
+        )
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        for cache in caches.values():
+            cache.close()
+
+if __name__ == '__main__':
+    table_name = 'reddit'  # Change this to 'usenet' or 'reddit' as needed
+    process_data_from_db(table_name)
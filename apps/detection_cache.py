@@ -0,0 +1,123 @@
+import os
+import json
+import sqlite3
+from collections import OrderedDict
+import dedup
+
+# Shared by every worker and run; entries of older ruleset versions are simply never read again
+DEFAULT_CACHE_PATH = os.environ.get('DISS_DETECTION_CACHE_PATH', 'detection_cache.sqlite')
+
+# Stands in for "not cached" in the memory tier, where None means "cached, no detection"
+MISSING = object()
+
+def to_cached(result):
+    # Results are cached without their row id, so any row with the same text can reuse them
+    return {column: value for column, value in result.items() if column != 'id'} if result else None
+
+def from_cached(comment_id, value):
+    return {'id': comment_id, **value} if value else None
+
+class DetectionCache:
+    """
+    Cache of detector results keyed on the comment text's digest and the ruleset version, so
+    text seen before, in any table or run, skips analysis. Each process keeps a bounded LRU in
+    memory in front of a SQLite file shared by all processes.
+    Cached values are the result columns without the `id`, or None for no detection.
+    Args:
+        detector: Name of the detector whose results are cached.
+        version: The detector's current ruleset version.
+        path: Path of the shared SQLite file.
+        memory_size: The maximum number of results kept in memory.
+    """
+
+    def __init__(self, detector, version, path=DEFAULT_CACHE_PATH, memory_size=100000):
+        self.detector = detector
+        self.version = version
+        self.memory_size = memory_size
+        self.memory = OrderedDict()
+        self.counts = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "detector TEXT NOT NULL, version INTEGER NOT NULL, digest BLOB NOT NULL, result TEXT, "
+            "PRIMARY KEY (detector, version, digest)) WITHOUT ROWID"
+        )
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def get_many(self, texts):
+        """
+        Look up a batch of comment texts.
+        Args:
+            texts: Iterable of comment texts, as passed to the detector.
+        Returns:
+            dict: Cached value per text found in either tier; texts not cached are left out.
+        """
+        found = {}
+        pending = {}
+        for text in set(texts):
+            key = dedup.digest(text)
+            value = self.memory.get(key, MISSING)
+            if value is MISSING:
+                pending[key] = text
+            else:
+                self.memory.move_to_end(key)
+                found[text] = value
+        self.counts['memory_hits'] += len(found)
+
+        keys = list(pending)
+        disk_hits = 0
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT digest, result FROM results WHERE detector = ? AND version = ? AND digest IN ({placeholders})",
+                [self.detector, self.version, *chunk]
+            )
+            for key, result in rows:
+                value = json.loads(result)
+                found[pending[key]] = value
+                self._remember(key, value)
+                disk_hits += 1
+
+        self.counts['disk_hits'] += disk_hits
+        self.counts['misses'] += len(pending) - disk_hits
+        return found
+
+    def put_many(self, results):
+        """
+        Store the results of a batch in both tiers.
+        Args:
+            results: Mapping of comment text to the value to cache.
+        """
+        rows = []
+        for text, value in results.items():
+            key = dedup.digest(text)
+            self._remember(key, value)
+            rows.append((self.detector, self.version, key, json.dumps(value)))
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO results (detector, version, digest, result) VALUES (?, ?, ?, ?)", rows)
+
+    def report(self):
+        total = sum(self.counts.values())
+        hit_rate = (self.counts['memory_hits'] + self.counts['disk_hits']) / total if total else 0.0
+        print(f"Detection cache ({self.detector} v{self.version}): {self.counts['memory_hits']} memory hits, "
+              f"{self.counts['disk_hits']} disk hits, {self.counts['misses']} misses ({hit_rate:.1%} hit rate).")
+
+    def close(self):
+        self.report()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
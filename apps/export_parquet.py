@@ -0,0 +1,178 @@
+import os
+import json
+import shutil
+import pyarrow as pa
+import pyarrow.dataset as ds
+from sqlalchemy import select, func, extract
+import database
+import batch_io
+import aggregations
+
+DEFAULT_SNAPSHOT_DIR = os.environ.get('DISS_SNAPSHOT_DIR', 'snapshot')
+
+# Kept inside the snapshot; pyarrow skips files and directories starting with '_' when reading the dataset
+STATE_FILE = '_export_state.json'
+STAGING_DIR = '_staging'
+
+# Hive's name for the partition of rows without a year, i.e. without a post_date
+NO_YEAR = '__HIVE_DEFAULT_PARTITION__'
+
+PATTERN_COLUMNS = ['objective_patterns', 'subjective_patterns', 'possessive_patterns', 'construct_patterns']
+
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('post_date', pa.timestamp('us')),
+    ('source', pa.string()),
+    ('year', pa.int32()),
+    ('forum_name', pa.string()),
+    ('has_detection', pa.bool_()),
+    ('has_detection_cc', pa.bool_()),
+    *[(column, pa.list_(pa.string())) for column in PATTERN_COLUMNS],
+])
+
+def decode_patterns(value):
+    # The detectors store `json.dumps` output, so most values are JSON strings holding an array
+    if isinstance(value, str):
+        value = json.loads(value)
+    return value if isinstance(value, list) else None
+
+def load_state(snapshot_dir):
+    path = os.path.join(snapshot_dir, STATE_FILE)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+def save_state(snapshot_dir, state):
+    # Written to a temporary file first, so an interrupted export never leaves a torn state file
+    path = os.path.join(snapshot_dir, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(path + '.tmp', path)
+
+def to_table(rows, source):
+    data = {name: [] for name in SCHEMA.names}
+    for row in rows:
+        data['id'].append(row.id)
+        data['post_date'].append(row.post_date)
+        data['source'].append(source)
+        data['year'].append(row.post_date.year if row.post_date else None)
+        data['forum_name'].append(getattr(row, 'forum_name', None))
+        data['has_detection'].append(row.has_detection)
+        data['has_detection_cc'].append(row.has_detection_cc)
+        for column in PATTERN_COLUMNS:
+            data[column].append(decode_patterns(getattr(row, column)))
+    return pa.Table.from_pydict(data, schema=SCHEMA)
+
+def year_signatures(session, model):
+    """
+    Summarise each year of a comment table in one aggregate query. A year's signature changes
+    whenever rows are added to or removed from it, or any of its rows is processed by a
+    detector, since that sets the row's ruleset version.
+    Args:
+        session: The database session to query with.
+        model: The SQLAlchemy model class for the table.
+    Returns:
+        dict: Signature per year partition name, a year or NO_YEAR.
+    """
+    year = extract('year', model.post_date).label('year')
+    query = select(
+        year,
+        func.count(),
+        func.max(model.id),
+        func.sum(func.coalesce(model.detection_version, 0)),
+        func.sum(func.coalesce(model.detection_cc_version, 0)),
+    ).group_by(year)
+
+    signatures = {}
+    for row_year, *signature in session.execute(query):
+        signatures[NO_YEAR if row_year is None else str(int(row_year))] = [int(value or 0) for value in signature]
+    return signatures
+
+def partition_dir(snapshot_dir, table_name, year):
+    return os.path.join(snapshot_dir, f"source={table_name}", f"year={year}")
+
+def export_year(session, model, table_name, columns, snapshot_dir, year, batch_size):
+    # The year is written to a staging directory and swapped in once complete, so readers and
+    # interrupted exports only ever see a whole partition
+    staging = os.path.join(snapshot_dir, STAGING_DIR, f"source={table_name}", f"year={year}")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    if year == NO_YEAR:
+        criteria = [model.post_date.is_(None)]
+    else:
+        # A range on post_date, so only the year's partition of the table is read
+        criteria = [aggregations.in_years(model.post_date, (int(year), int(year)))]
+
+    exported = 0
+    for rows in batch_io.stream_rows(session, model, columns, batch_size, *criteria):
+        # Source and year come from the directory names, as with a partitioned write
+        table = to_table(rows, table_name).drop_columns(['source', 'year'])
+        ds.write_dataset(table, staging, format='parquet', basename_template=f"part-{rows[0].id}-{{i}}.parquet",
+                         existing_data_behavior='overwrite_or_ignore')
+        exported += len(rows)
+
+    target = partition_dir(snapshot_dir, table_name, year)
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(staging, target)
+    return exported
+
+def export_table(session, table_name, snapshot_dir=DEFAULT_SNAPSHOT_DIR, batch_size=100000, rebuild=False):
+    """
+    Bring a comment table's part of a Parquet snapshot, partitioned by source and year, up to date.
+    Every year whose rows were added, removed or processed by a detector since the last export
+    is rewritten whole; other years are left as they are.
+    Args:
+        session: The database session to read with.
+        table_name: The table to export, 'test', 'usenet' or 'reddit'.
+        snapshot_dir: The snapshot directory.
+        batch_size: The number of rows per batch, and at most per file.
+        rebuild: Whether to drop the table's part of the snapshot and export it from scratch.
+    Returns:
+        int: The number of rows exported.
+    """
+    model = batch_io.get_model(table_name)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    state = load_state(snapshot_dir)
+
+    # Snapshots from before signatures were recorded are exported again in full
+    if rebuild or not isinstance(state.get(table_name), dict):
+        shutil.rmtree(os.path.join(snapshot_dir, f"source={table_name}"), ignore_errors=True)
+        state[table_name] = {}
+        save_state(snapshot_dir, state)
+    exported_signatures = state[table_name]
+
+    columns = [model.id, model.post_date, model.has_detection, model.has_detection_cc]
+    columns += [getattr(model, column) for column in PATTERN_COLUMNS]
+    if 'forum_name' in model.__table__.c:
+        columns.append(model.forum_name)
+
+    signatures = year_signatures(session, model)
+    changed = sorted(year for year, signature in signatures.items() if exported_signatures.get(year) != signature)
+    print(f"{len(changed)} of {len(signatures)} years of {table_name} changed since the last export.")
+
+    exported = 0
+    for year in changed:
+        exported += export_year(session, model, table_name, columns, snapshot_dir, year, batch_size)
+        # Recorded only once the year is in place, so an interrupted export redoes it
+        exported_signatures[year] = signatures[year]
+        save_state(snapshot_dir, state)
+
+    for year in set(exported_signatures) - set(signatures):
+        # Every row of the year is gone from the table
+        shutil.rmtree(partition_dir(snapshot_dir, table_name, year), ignore_errors=True)
+        del exported_signatures[year]
+        save_state(snapshot_dir, state)
+
+    print(f"Exported {exported} rows from {table_name} to {snapshot_dir}.")
+    return exported
+
+def main(table_names=('usenet', 'reddit'), snapshot_dir=DEFAULT_SNAPSHOT_DIR, rebuild=False):
+    with database.session_scope() as session:
+        for table_name in table_names:
+            export_table(session, table_name, snapshot_dir, rebuild=rebuild)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import json
+import textwrap
+from itertools import islice
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_SEPARATORS = _WHITESPACE + ','
+
+def iter_records(path, chunk_size=1 << 20):
+    """
+    Yield the records of a JSON file one at a time without loading the whole file.
+    Handles both a top-level JSON array and JSON Lines (one record per line).
+    Args:
+        path: Path to the JSON file.
+        chunk_size: Number of characters read from the file at a time.
+    Returns:
+        generator: Yields each decoded record in file order.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        first = file.read(1)
+        while first and first.isspace():
+            first = file.read(1)
+
+        if first == '[':
+            yield from _iter_array(file, chunk_size)
+        elif first:
+            file.seek(0)
+            for line in file:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+def _iter_array(file, chunk_size):
+    # Decode one array element at a time from a sliding buffer, reading more only when
+    # the element at the front of the buffer is incomplete
+    buffer = ''
+    pos = 0
+    eof = False
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in _SEPARATORS:
+            pos += 1
+
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unterminated JSON array")
+            buffer, pos, eof = _refill(file, buffer, pos, chunk_size)
+            continue
+
+        if buffer[pos] == ']':
+            return
+
+        try:
+            record, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buffer, pos, eof = _refill(file, buffer, pos, chunk_size)
+            continue
+
+        # An element is only complete once a ',' or ']' follows it: a number cut after its
+        # '.' or 'e', or at the very end of the buffer, decodes to a prefix of itself
+        following = end
+        while following < len(buffer) and buffer[following] in _WHITESPACE:
+            following += 1
+        if following == len(buffer) or buffer[following] not in ',]':
+            if eof:
+                if following < len(buffer):
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, following)
+            else:
+                buffer, pos, eof = _refill(file, buffer, pos, chunk_size)
+                continue
+
+        yield record
+        pos = end
+
+def _refill(file, buffer, pos, chunk_size):
+    chunk = file.read(chunk_size)
+    return buffer[pos:] + chunk, 0, not chunk
+
+def batched(iterable, size):
+    """
+    Group an iterable into lists of at most `size` items.
+    Args:
+        iterable: The items to group.
+        size: The maximum number of items per batch.
+    Returns:
+        generator: Yields lists of items in order.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+class JsonArrayWriter:
+    """
+    Write records to a file as a JSON array, one record at a time.
+    The output is identical to `json.dump(records, file, indent=indent)`.
+    Args:
+        file: The open text file to write to.
+        indent: The indentation used for each record.
+    """
+
+    def __init__(self, file, indent=4):
+        self.file = file
+        self.indent = indent
+        self.count = 0
+
+    def write(self, record):
+        text = textwrap.indent(json.dumps(record, indent=self.indent), ' ' * self.indent)
+        self.file.write(('[\n' if self.count == 0 else ',\n') + text)
+        self.count += 1
+
+    def close(self):
+        self.file.write('[]' if self.count == 0 else '\n]')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
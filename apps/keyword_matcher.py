@@ -0,0 +1,42 @@
+import ahocorasick
+
+
+class KeywordMatcher:
+    """
+    Match every keyword of every category in a single pass over the text.
+    Args:
+        categories: Mapping of category name to a list of keywords.
+    """
+
+    def __init__(self, categories):
+        self.automaton = ahocorasick.Automaton()
+        for category, keywords in categories.items():
+            for keyword in keywords:
+                needle = keyword.lower()
+                # A keyword listed in several categories is reported for each of them
+                if needle in self.automaton:
+                    _, hits = self.automaton.get(needle)
+                    hits.append((category, keyword))
+                else:
+                    self.automaton.add_word(needle, (len(needle), [(category, keyword)]))
+        self.automaton.make_automaton()
+
+    def find(self, text):
+        """
+        Find the keywords occurring in the text as whole words.
+        Args:
+            text: The text to search.
+        Returns:
+            list of tuples: Each tuple contains (category, keyword), in order of appearance.
+        """
+        text = text.lower()
+        matches = []
+        for end, (length, hits) in self.automaton.iter(text):
+            start = end - length + 1
+            # Respect word boundaries on both sides of the match
+            if start > 0 and text[start - 1].isalnum():
+                continue
+            if end + 1 < len(text) and text[end + 1].isalnum():
+                continue
+            matches.extend(hits)
+        return matches
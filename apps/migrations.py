@@ -0,0 +1,214 @@
+import logging
+from sqlalchemy import text
+import database
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+COMMENT_TABLES = ['test', 'usenet', 'reddit']
+
+def add_cluster_id(table_name):
+    # Near-duplicate cluster of each comment, see near_dedup.py
+    return [
+        f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS cluster_id INTEGER",
+        f"CREATE INDEX IF NOT EXISTS ix_{table_name}_cluster_id ON {table_name} (cluster_id)",
+    ]
+
+def add_detection_versions(table_name):
+    # Ruleset version that last processed each row, NULL until a detector has seen it
+    return [
+        f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS detection_version INTEGER",
+        f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS detection_cc_version INTEGER",
+    ]
+
+# Years before this go to the default partition, so a stray parse like year 1 cannot create a
+# partition per year since
+FIRST_PARTITION_YEAR = 1980
+
+def partition_exists(session, table_name, year):
+    return session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': f"{table_name}_{year}"}).scalar()
+
+def is_partitioned(session, table_name):
+    return session.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name))"
+    ), {'name': table_name}).scalar()
+
+# (table name, year) pairs this process has already seen a partition for
+_known_partitions = set()
+
+def ensure_year_partition(session, table_name, year):
+    """
+    Make sure a partitioned comment table has a partition for a year, so rows of years after the
+    migration do not pile up in the default partition. Rows of that year already in the default
+    partition are moved into the new one, since Postgres refuses to attach over them.
+    Commits, so call it between batches rather than with rows pending.
+    Args:
+        session: The database session to use.
+        table_name: The comment table.
+        year: The year rows are about to be loaded for.
+    Returns:
+        bool: Whether a partition was created.
+    """
+    if year < FIRST_PARTITION_YEAR or (table_name, year) in _known_partitions:
+        return False
+    if not is_partitioned(session, table_name):
+        # Not migrated yet; everything goes into the one table
+        _known_partitions.add((table_name, year))
+        return False
+
+    partition = f"{table_name}_{year}"
+    # Loaders running at the same time create each partition once
+    session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {'name': partition})
+    created = not partition_exists(session, table_name, year)
+    if created:
+        start, end = f"{year}-01-01", f"{year + 1}-01-01"
+        session.execute(text(f"CREATE TABLE {partition} (LIKE {table_name} INCLUDING DEFAULTS)"))
+        session.execute(text(
+            f"WITH moved AS (DELETE FROM {table_name}_default WHERE post_date >= '{start}' AND post_date < '{end}' "
+            f"RETURNING *) INSERT INTO {partition} SELECT * FROM moved"
+        ))
+        session.execute(text(f"ALTER TABLE {table_name} ATTACH PARTITION {partition} FOR VALUES FROM ('{start}') TO ('{end}')"))
+        logging.info(f"Created partition {partition}.")
+    session.commit()
+    _known_partitions.add((table_name, year))
+    return created
+
+def ensure_year_partitions(session, table_name, post_dates):
+    # Dates are datetimes or the cleaners' 'YYYY-MM-DD HH:MM:SS' strings
+    years = {date.year if hasattr(date, 'year') else int(str(date)[:4]) for date in post_dates}
+    for year in sorted(years):
+        ensure_year_partition(session, table_name, year)
+
+def partition_by_year(session, table_name, batch_size=100000):
+    # Rebuild the table range-partitioned on post_date, one partition per year through next year and
+    # later years added by ensure_year_partition as rows arrive; out-of-range years land in the default
+    # partition. The primary key becomes (id, post_date), as Postgres requires the partition key in it;
+    # `id` still comes from the same sequence, so it stays unique on its own. Rows are copied in id
+    # ranges committed one by one, so an interrupted run picks up after the last committed range.
+    old_table = f"{table_name}_unpartitioned"
+    copying = session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': old_table}).scalar()
+    if not copying and is_partitioned(session, table_name):
+        # Finished by an earlier run that stopped before recording the migration
+        return
+    if not copying:
+        # A partition key cannot be NULL. Undated rows get the current datetime, as the Usenet
+        # cleaner does for posts without a usable date
+        undated = session.execute(text(f"UPDATE {table_name} SET post_date = now() WHERE post_date IS NULL")).rowcount
+        if undated:
+            logging.warning(f"Dated {undated} rows of {table_name} without a post_date with the current datetime.")
+
+        for statement in [
+            f"ALTER TABLE {table_name} RENAME TO {old_table}",
+            f"CREATE TABLE {table_name} (LIKE {old_table} INCLUDING DEFAULTS, "
+            f"CONSTRAINT {table_name}_id_post_date_pkey PRIMARY KEY (id, post_date)) PARTITION BY RANGE (post_date)",
+            f"CREATE TABLE {table_name}_default PARTITION OF {table_name} DEFAULT",
+            f"""DO $$
+            DECLARE
+                first_year int;
+                last_year int := extract(year FROM now())::int + 1;
+            BEGIN
+                SELECT greatest(coalesce(min(extract(year FROM post_date))::int, last_year), {FIRST_PARTITION_YEAR})
+                INTO first_year FROM {old_table};
+                FOR y IN first_year..last_year LOOP
+                    EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                                   '{table_name}_' || y, '{table_name}', make_date(y, 1, 1), make_date(y + 1, 1, 1));
+                END LOOP;
+            END $$""",
+            f"""DO $$
+            DECLARE
+                id_sequence text := pg_get_serial_sequence('{old_table}', 'id');
+            BEGIN
+                IF id_sequence IS NOT NULL THEN
+                    EXECUTE format('ALTER SEQUENCE %s OWNED BY {table_name}.id', id_sequence);
+                END IF;
+            END $$""",
+        ]:
+            session.execute(text(statement))
+        session.commit()
+
+    # Rows loaded while the copy runs take ids past the old table's, so only lower ids say how far it got
+    last_id = session.execute(text(f"SELECT coalesce(max(id), 0) FROM {old_table}")).scalar()
+    copied_up_to = session.execute(text(f"SELECT coalesce(max(id), 0) FROM {table_name} WHERE id <= {last_id}")).scalar()
+    for start in range(copied_up_to, last_id, batch_size):
+        session.execute(text(
+            f"INSERT INTO {table_name} SELECT * FROM {old_table} WHERE id > {start} AND id <= {start + batch_size}"
+        ))
+        session.commit()
+        logging.info(f"Copied {table_name} rows up to id {min(start + batch_size, last_id)} of {last_id}.")
+
+    old_count = session.execute(text(f"SELECT count(*) FROM {old_table}")).scalar()
+    new_count = session.execute(text(f"SELECT count(*) FROM {table_name} WHERE id <= {last_id}")).scalar()
+    if old_count != new_count:
+        raise RuntimeError(f"{table_name} has {new_count} rows after copying but {old_table} has {old_count}; "
+                           f"{old_table} is kept for inspection.")
+
+    for statement in [
+        f"DROP TABLE {old_table}",
+        f"CREATE INDEX ix_{table_name}_post_date ON {table_name} (post_date)",
+        f"CREATE INDEX ix_{table_name}_cluster_id ON {table_name} (cluster_id)",
+        # Detected rows are a small share of each table; the aggregations count them per year
+        f"CREATE INDEX ix_{table_name}_has_detection ON {table_name} (post_date) WHERE has_detection",
+        f"CREATE INDEX ix_{table_name}_has_detection_cc ON {table_name} (post_date) WHERE has_detection_cc",
+        # Both arms of batch_io.needs_processing, NULL and older versions, can use these
+        f"CREATE INDEX ix_{table_name}_detection_version ON {table_name} (detection_version)",
+        f"CREATE INDEX ix_{table_name}_detection_cc_version ON {table_name} (detection_cc_version)",
+        f"ANALYZE {table_name}",
+    ]:
+        session.execute(text(statement))
+
+# Applied in order, each at most once per database. Append new migrations; never edit applied ones.
+MIGRATIONS = [
+    ('0001_add_cluster_id', add_cluster_id),
+    ('0002_add_detection_versions', add_detection_versions),
+    ('0003_partition_by_year', partition_by_year),
+]
+
+# Migrations too large for one transaction. Instead of returning statements they take the session
+# and a table name and commit as they go, and must pick up where an interrupted run stopped.
+SELF_COMMITTING = {'0003_partition_by_year'}
+
+def applied_versions(session):
+    session.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version TEXT PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+    ))
+    return {row.version for row in session.execute(text("SELECT version FROM schema_migrations"))}
+
+def migrate(session, tables=COMMENT_TABLES):
+    """
+    Apply every pending migration to the comment tables, one transaction per migration except for
+    those in SELF_COMMITTING, whose last steps commit together with the version record.
+    Args:
+        session: The database session to migrate with.
+        tables: The comment tables to migrate.
+    Returns:
+        list: The versions applied by this call.
+    """
+    applied = applied_versions(session)
+    session.commit()
+
+    newly_applied = []
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+
+        logging.info(f"Applying migration {version}.")
+        try:
+            for table_name in tables:
+                if version in SELF_COMMITTING:
+                    migration(session, table_name)
+                    continue
+                for statement in migration(table_name):
+                    session.execute(text(statement))
+            session.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"), {'version': version})
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        newly_applied.append(version)
+
+    logging.info(f"Applied {len(newly_applied)} migrations.")
+    return newly_applied
+
+if __name__ == '__main__':
+    with database.session_scope() as session:
+        migrate(session)
@@ -1,23 +1,41 @@
-from sqlalchemy import Column, Integer, DateTime, Text, Boolean, Float
+from sqlalchemy import Column, Integer, DateTime, Text, Boolean, Float, Index, text
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.dialects.postgresql import JSONB  
 
+# The comment tables are range-partitioned by post_date year (migration 0003_partition_by_year), so
+# queries bounded on post_date only read the matching partitions. These are the indexes it creates.
+# The tables' primary key is then (id, post_date); the models map `id` alone, which the sequence
+# keeps unique, so bulk updates still match rows by id.
+def comment_table_indexes(table_name):
+    return (
+        Index(f'ix_{table_name}_post_date', 'post_date'),
+        Index(f'ix_{table_name}_cluster_id', 'cluster_id'),
+        Index(f'ix_{table_name}_has_detection', 'post_date', postgresql_where=text('has_detection')),
+        Index(f'ix_{table_name}_has_detection_cc', 'post_date', postgresql_where=text('has_detection_cc')),
+        Index(f'ix_{table_name}_detection_version', 'detection_version'),
+        Index(f'ix_{table_name}_detection_cc_version', 'detection_cc_version'),
+    )
+
 class Base(DeclarativeBase):
     pass
     
 class Usenet(Base):
     __tablename__ = 'usenet'
+    __table_args__ = comment_table_indexes('usenet')
 
     id = Column(Integer, primary_key=True)
     forum_name = Column(Text)
-    post_date = Column(DateTime)
+    post_date = Column(DateTime, nullable=False)
     comment = Column(JSONB)
     has_detection = Column(Boolean, default=False) 
     has_detection_cc = Column(Boolean, default=False) 
-    objective_patterns = Column(JSONB)  
-    subjective_patterns = Column(JSONB)
-    possessive_patterns = Column(JSONB)
-    construct_patterns = Column(JSONB)
+    objective_patterns = Column(JSONB(none_as_null=True))  
+    subjective_patterns = Column(JSONB(none_as_null=True))
+    possessive_patterns = Column(JSONB(none_as_null=True))
+    construct_patterns = Column(JSONB(none_as_null=True))
+    cluster_id = Column(Integer)  # Near-duplicate cluster, the smallest member id
+    detection_version = Column(Integer)  # Ruleset version of ob_sub_patterns that last processed the row
+    detection_cc_version = Column(Integer)  # Ruleset version of construct_concepts_patterns that last processed the row
     
     def __repr__(self):
         return (f"<Usenet(id={self.id} post_date='{self.post_date}', "
@@ -28,16 +46,20 @@ class Usenet(Base):
 # Define a class representing a table in the database
 class Reddit(Base):
     __tablename__ = 'reddit'
+    __table_args__ = comment_table_indexes('reddit')
 
     id = Column(Integer, primary_key=True)
-    post_date = Column(DateTime)
+    post_date = Column(DateTime, nullable=False)
     comment = Column(JSONB)
     has_detection = Column(Boolean, default=False)  
     has_detection_cc = Column(Boolean, default=False)
-    objective_patterns = Column(JSONB) 
-    subjective_patterns = Column(JSONB) 
-    possessive_patterns = Column(JSONB) 
-    construct_patterns = Column(JSONB)
+    objective_patterns = Column(JSONB(none_as_null=True)) 
+    subjective_patterns = Column(JSONB(none_as_null=True)) 
+    possessive_patterns = Column(JSONB(none_as_null=True)) 
+    construct_patterns = Column(JSONB(none_as_null=True))
+    cluster_id = Column(Integer)  # Near-duplicate cluster, the smallest member id
+    detection_version = Column(Integer)  # Ruleset version of ob_sub_patterns that last processed the row
+    detection_cc_version = Column(Integer)  # Ruleset version of construct_concepts_patterns that last processed the row
 
     def __repr__(self):
         return (f"<Reddit(id={self.id} post_date='{self.post_date}', "
@@ -47,17 +69,21 @@ class Reddit(Base):
     
 class Test(Base):
     __tablename__ = 'test'
+    __table_args__ = comment_table_indexes('test')
 
     id = Column(Integer, primary_key=True)
     forum_name = Column(Text, nullable=True)  
-    post_date = Column(DateTime)
+    post_date = Column(DateTime, nullable=False)
     comment = Column(JSONB)
     has_detection = Column(Boolean, default=False)
     has_detection_cc = Column(Boolean, default=False)
-    objective_patterns = Column(JSONB)
-    subjective_patterns = Column(JSONB)
-    possessive_patterns = Column(JSONB)
-    construct_patterns = Column(JSONB)
+    objective_patterns = Column(JSONB(none_as_null=True))
+    subjective_patterns = Column(JSONB(none_as_null=True))
+    possessive_patterns = Column(JSONB(none_as_null=True))
+    construct_patterns = Column(JSONB(none_as_null=True))
+    cluster_id = Column(Integer)  # Near-duplicate cluster, the smallest member id
+    detection_version = Column(Integer)  # Ruleset version of ob_sub_patterns that last processed the row
+    detection_cc_version = Column(Integer)  # Ruleset version of construct_concepts_patterns that last processed the row
     
     def __repr__(self):
         return (f"<Test(id={self.id}, forum_name='{self.forum_name}', post_date='{self.post_date}', "
@@ -0,0 +1,261 @@
+import os
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import numpy as np
+from sqlalchemy import or_, update, func, select
+from sqlalchemy.orm import aliased
+from tqdm import tqdm
+import database
+import batch_io
+import async_database
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Largest prime below 2**32, so (a * h + b) fits in 64 bits for 32-bit shingle hashes
+MERSENNE_PRIME = np.uint64(4294967291)
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles of cleaned comments.
+    With `bands` bands of `num_perm // bands` rows, two comments share an LSH bucket with high
+    probability once their Jaccard similarity passes roughly (1 / bands) ** (bands / num_perm).
+    Args:
+        num_perm: The number of hash permutations per signature.
+        bands: The number of LSH bands the signature is split into.
+        shingle_size: The number of words per shingle.
+        seed: Seed for the permutations, so signatures are comparable across runs.
+    """
+
+    def __init__(self, num_perm=120, bands=12, shingle_size=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands.")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        generator = np.random.default_rng(seed)
+        self.a = generator.integers(1, int(MERSENNE_PRIME), num_perm, dtype=np.uint64)
+        self.b = generator.integers(0, int(MERSENNE_PRIME), num_perm, dtype=np.uint64)
+
+    def shingles(self, text):
+        words = text.split()
+        if len(words) <= self.shingle_size:
+            return {' '.join(words)}
+        return {' '.join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text):
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') for s in self.shingles(text)),
+            dtype=np.uint64
+        )
+        permuted = (np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature):
+        # One key per band; equal keys mean the band rows agree exactly. The band number is part
+        # of the key, so keys of different bands never collide
+        return [
+            int.from_bytes(hashlib.blake2b(bytes([i]) + signature[i * self.rows:(i + 1) * self.rows].tobytes(),
+                                           digest_size=8).digest(), 'little', signed=True)
+            for i in range(self.bands)
+        ]
+
+class ClusterIndex:
+    """
+    Union-find over the ids of comments that share an LSH bucket with another comment.
+    Ids never added are clusters of their own; a cluster's id is its smallest member id.
+    """
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, comment_id):
+        root = comment_id
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent.get(comment_id, comment_id) != root:
+            self.parent[comment_id], comment_id = root, self.parent[comment_id]
+        return root
+
+    def union(self, first_id, second_id):
+        first_root, second_root = self.find(first_id), self.find(second_id)
+        if first_root != second_root:
+            # The smaller id stays the root, so it is the cluster id
+            low, high = sorted((first_root, second_root))
+            self.parent[high] = low
+            self.parent.setdefault(low, low)
+
+class BandStore:
+    """
+    The LSH buckets of a table, as (band key, comment id) pairs in a temporary SQLite file, so
+    memory does not grow with the table. Keys are grouped on disk once every comment is added.
+    Args:
+        work_dir: Directory for the temporary file; defaults to the system's temporary directory.
+    """
+
+    def __init__(self, work_dir=None):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite', prefix='bands-', dir=work_dir)
+        os.close(handle)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute("CREATE TABLE bands (key INTEGER NOT NULL, id INTEGER NOT NULL)")
+
+    def add_many(self, pairs):
+        with self.connection:
+            self.connection.executemany("INSERT INTO bands (key, id) VALUES (?, ?)", pairs)
+
+    def shared_buckets(self):
+        # Only keys held by several comments matter; the index lets SQLite group them in key order
+        self.connection.execute("CREATE INDEX bands_key_id ON bands (key, id)")
+        rows = self.connection.execute(
+            "SELECT key, id FROM bands WHERE key IN (SELECT key FROM bands GROUP BY key HAVING count(*) > 1) "
+            "ORDER BY key, id"
+        )
+        current_key, first_id = None, None
+        for key, comment_id in rows:
+            if key != current_key:
+                current_key, first_id = key, comment_id
+            else:
+                yield first_id, comment_id
+
+    def close(self):
+        self.connection.close()
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+def build_clusters(session, model, batch_size=10000, write_batch_size=10000, hasher=None, work_dir=None,
+                   write_concurrency=1):
+    """
+    Cluster a whole comment table by near-duplicate content and store each row's cluster id.
+    Rows without a near duplicate get their own id, so `cluster_id == id` marks a representative.
+    Band keys go to a temporary file and only comments sharing a bucket are held in memory.
+    Args:
+        session: The database session to read and write with.
+        model: The SQLAlchemy model class for the table.
+        batch_size: The number of comments read per batch.
+        write_batch_size: The number of cluster ids written per UPDATE.
+        hasher: The MinHasher to use; defaults to MinHasher().
+        work_dir: Directory for the temporary band file; defaults to the system's temporary directory.
+        write_concurrency: The number of cluster id batches written at once on separate
+            connections of the configured database; needs async_database to be available.
+    Returns:
+        dict: The number of comments and of clusters.
+    """
+    hasher = hasher or MinHasher()
+    index = ClusterIndex()
+    comments_seen = 0
+
+    with BandStore(work_dir) as bands:
+        for comments in tqdm(batch_io.stream_comments(session, model, batch_size), desc="Hashing comments", unit="batch"):
+            bands.add_many(
+                (key, comment_id) for comment_id, comment in comments
+                for key in hasher.band_keys(hasher.signature(comment or ''))
+            )
+            comments_seen += len(comments)
+
+        for first_id, comment_id in bands.shared_buckets():
+            index.union(first_id, comment_id)
+
+    # Every row starts as its own cluster, one id range per statement
+    min_id, max_id = session.execute(select(func.min(model.id), func.max(model.id))).one()
+    if min_id is not None:
+        for start in range(min_id, max_id + 1, write_batch_size):
+            session.execute(
+                update(model)
+                .where(model.id >= start, model.id < start + write_batch_size)
+                .where(model.cluster_id.is_distinct_from(model.id))
+                .values(cluster_id=model.id)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+
+    # Then the members of larger clusters point at their smallest member
+    members = sorted(comment_id for comment_id in index.parent if index.find(comment_id) != comment_id)
+    batches = (
+        [{'id': comment_id, 'cluster_id': index.find(comment_id)} for comment_id in members[start:start + write_batch_size]]
+        for start in range(0, len(members), write_batch_size)
+    )
+    if write_concurrency > 1 and async_database.is_available():
+        # The batches hold disjoint ids, so they can be written side by side
+        async_database.run(async_database.bulk_update_concurrently(model, batches, write_concurrency))
+    else:
+        for rows in batches:
+            batch_io.bulk_update(session, model, rows)
+            session.commit()
+
+    clusters = comments_seen - len(members)
+    logging.info(f"Collapsed {comments_seen} comments in {model.__tablename__} into {clusters} clusters.")
+    return {'comments': comments_seen, 'clusters': clusters}
+
+def representatives_only(model):
+    # Rows not clustered yet are processed as they are
+    return or_(model.cluster_id.is_(None), model.cluster_id == model.id)
+
+def fan_out_results(session, model, columns, representative_ids):
+    """
+    Copy detection results from cluster representatives to the other members of their clusters,
+    as one UPDATE ... FROM. The caller is responsible for committing.
+    Args:
+        session: The database session to write with.
+        model: The SQLAlchemy model class for the table.
+        columns: Names of the result columns to copy.
+        representative_ids: Ids of the representatives whose results were just written.
+    Returns:
+        int: The number of member rows updated.
+    """
+    if not representative_ids:
+        return 0
+
+    representative = aliased(model)
+    statement = (
+        update(model)
+        .where(model.cluster_id == representative.id)
+        .where(model.id != representative.id)
+        .where(representative.id.in_(representative_ids))
+        .values({column: getattr(representative, column) for column in columns})
+        .execution_options(synchronize_session=False)
+    )
+    return session.execute(statement).rowcount
+
+def fan_out_to_stale_members(session, model, columns, version_column, version):
+    """
+    Copy detection results from representatives processed by the current ruleset to members of
+    their clusters that hold another version, as one UPDATE ... FROM. These are rows clustered
+    after their representative was processed: they are not representatives, so no run reads
+    them, and their representative is current, so no fan-out reaches them either.
+    The caller is responsible for committing.
+    Args:
+        session: The database session to write with.
+        model: The SQLAlchemy model class for the table.
+        columns: Names of the result columns to copy, including `version_column`.
+        version_column: Name of the column holding the ruleset version that processed a row.
+        version: The current ruleset version.
+    Returns:
+        int: The number of member rows updated.
+    """
+    representative = aliased(model)
+    statement = (
+        update(model)
+        .where(model.cluster_id == representative.id)
+        .where(model.id != representative.id)
+        .where(getattr(representative, version_column) == version)
+        .where(getattr(model, version_column).is_distinct_from(getattr(representative, version_column)))
+        .values({column: getattr(representative, column) for column in columns})
+        .execution_options(synchronize_session=False)
+    )
+    return session.execute(statement).rowcount
+
+if __name__ == '__main__':
+    table_name = 'reddit'  # Change this to 'usenet' or 'reddit' as needed
+    with database.session_scope() as session:
+        build_clusters(session, batch_io.get_model(table_name))
@@ -0,0 +1,29 @@
+import spacy
+
+# The detectors only read token text, part-of-speech tags and the dependency parse,
+# so the named entity recogniser and the lemmatizer are dead weight on every comment
+UNUSED_COMPONENTS = ['ner', 'lemmatizer']
+
+def load_nlp(model_name='en_core_web_sm', disable=UNUSED_COMPONENTS):
+    """
+    Load a spaCy pipeline with the components the detectors never read disabled.
+    Args:
+        model_name: The name of the spaCy model to load.
+        disable: Names of pipeline components to disable.
+    Returns:
+        spacy.language.Language: The trimmed pipeline.
+    """
+    return spacy.load(model_name, disable=disable)
+
+def pipe_comments(nlp, comments, batch_size=1000, n_process=1):
+    """
+    Parse comments in batches with `nlp.pipe`, keeping each comment's context attached.
+    Args:
+        nlp: The spaCy pipeline to run.
+        comments: Iterable of (text, context) tuples.
+        batch_size: Number of texts buffered per batch.
+        n_process: Number of processes spaCy spreads the batches across.
+    Returns:
+        generator: Yields (doc, context) tuples in input order.
+    """
+    return nlp.pipe(comments, as_tuples=True, batch_size=batch_size, n_process=n_process)
@@ -1,16 +1,55 @@
-import spacy
 import json
 from tqdm import tqdm
 import multiprocessing
-import database
-import models
+import multiprocessing.util
+import batch_io
 import logging
+import re
+import nlp_pipeline
+import detection_cache
+import pipeline
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Load the transformer-based spaCy English language model
-nlp = spacy.load('en_core_web_sm')
+# The spaCy English language model, loaded once per process by `get_nlp`
+nlp = None
+
+def get_nlp():
+    # Load the model without the components the detectors never read; also used as the
+    # worker pool initializer so each worker warms its model up before taking tasks
+    global nlp
+    if nlp is None:
+        nlp = nlp_pipeline.load_nlp()
+    return nlp
+
+# Stored with every processed row; bump it whenever the word lists or pattern rules change,
+# and the next run reprocesses every row parsed by an older version
+RULESET_VERSION = 1
+
+# Written to rows without a detection, clearing results left by an older ruleset
+NO_DETECTION = {
+    'has_detection': False,
+    'objective_patterns': None,
+    'subjective_patterns': None,
+    'possessive_patterns': None,
+    'detection_version': RULESET_VERSION,
+}
+
+# Per-process state of pool workers, set by `init_worker`
+cache = None
+worker_options = {}
+
+def init_worker(cache_path=None, use_pipe=True, nlp_batch_size=1000):
+    # Pool initializer: warm up the spaCy model and open this worker's cache
+    global cache
+    get_nlp()
+    worker_options.update(use_pipe=use_pipe, nlp_batch_size=nlp_batch_size)
+    if cache_path:
+        cache = detection_cache.DetectionCache('ob_sub', RULESET_VERSION, cache_path)
+        # Workers never return to this module, so the cache is closed, and its report printed,
+        # by a finalizer run when the pool shuts its workers down
+        multiprocessing.util.Finalize(cache, cache.close, exitpriority=10)
 
 # List of acceptable objective adjectives (no repeats)
 acceptable_objective_adjectives = [
@@ -26,8 +65,17 @@ acceptable_objective_adjectives = [
 # Define synonyms for "truth"
 truth_synonyms = ["truth"]
 
+# Every pattern family needs a token from `truth_synonyms`, so a comment that does not even
+# contain one as a substring can never produce a detection and need not be parsed
+truth_prefilter = re.compile('|'.join(re.escape(word) for word in truth_synonyms), re.IGNORECASE)
+
+def might_contain_truth(comment):
+    return truth_prefilter.search(comment) is not None
+
 def analyse_comment_spacy(comment):
-    doc = nlp(comment)
+    return analyse_doc(get_nlp()(comment))
+
+def analyse_doc(doc):
     objective_patterns = set()
     possessive_patterns = set()
     subjective_patterns = set()
@@ -69,20 +117,7 @@ def analyse_comment_spacy(comment):
 
     return objective_patterns, possessive_patterns, subjective_patterns
 
-def process_comment(item):
-    # Extract the comment text and strip any leading/trailing whitespace
-    comment_text = item.comment.strip()
-
-    if item.has_detection:
-        return None
-
-    # Skip processing if the comment text is empty or None
-    if not comment_text:
-        return None
-
-    # Analyse the comment text using the `analyse_comment_spacy` function
-    objective_patterns, possessive_patterns, subjective_patterns = analyse_comment_spacy(comment_text)
-
+def build_result(comment_id, objective_patterns, possessive_patterns, subjective_patterns):
     # Convert lists of patterns to JSON strings for `jsonb` columns
     objective_patterns_str = json.dumps(objective_patterns) if objective_patterns else '[]'
     subjective_patterns_str = json.dumps(subjective_patterns) if subjective_patterns else '[]'
@@ -91,91 +126,125 @@ def process_comment(item):
     # Prepare the result dictionary if any patterns are found
     if subjective_patterns or possessive_patterns:
         return {
-            'id': item.id,
-            'post_date': item.post_date,
-            'comment': comment_text,
+            'id': comment_id,
             'has_detection': True,  
             'objective_patterns': objective_patterns_str,  # Store JSON string
             'subjective_patterns': subjective_patterns_str,  # Store JSON string
-            'possessive_patterns': possessive_patterns_str   # Store JSON string
+            'possessive_patterns': possessive_patterns_str,  # Store JSON string
+            'detection_version': RULESET_VERSION
         }
     else:
         return None
 
-def process_comments_multiprocessing(comments):
+def prefilter_comments(comments):
+    # Drop comments that cannot match before they are sent to spaCy
+    candidates = [(comment_id, text) for comment_id, text in comments if text and might_contain_truth(text)]
+    logging.info(f"Prefilter skipped {len(comments) - len(candidates)} of {len(comments)} comments without a truth synonym.")
+    return candidates
+
+def analyse_comments(comments, use_pipe=True, nlp_batch_size=1000, cache=None):
+    """
+    Analyse comments in this process, answering text analysed before from the cache.
+    Args:
+        comments: List of (id, text) tuples.
+        use_pipe: Whether to parse the texts in batches with `nlp.pipe` or one call at a time.
+        nlp_batch_size: The number of texts per `nlp.pipe` batch.
+        cache: Optional DetectionCache, looked up and filled once for the whole list.
+    Returns:
+        list of dicts: The results of the comments with a detection.
+    """
     results = []
 
-    # Use all available cores for multiprocessing
-    num_cores = multiprocessing.cpu_count()
-
-    with multiprocessing.Pool(processes=num_cores) as pool:
-        # Correctly pass the list of comments to pool.imap
-        iterator = pool.imap(process_comment, comments)
-
-        with tqdm(total=len(comments), desc='Processing comments', unit=' comments') as pbar:
-            for result in iterator:
+    # Empty and whitespace-only comments have nothing to analyse
+    texts = []
+    for comment_id, comment_text in comments:
+        comment_text = (comment_text or '').strip()
+        if comment_text:
+            texts.append((comment_text, comment_id))
+
+    if cache is not None:
+        # Text analysed before, by any run, is answered without spaCy
+        cached = cache.get_many(text for text, _ in texts)
+        for text, comment_id in texts:
+            if text in cached:
+                result = detection_cache.from_cached(comment_id, cached[text])
                 if result:
                     results.append(result)
-                pbar.update(1)
+        texts = [(text, comment_id) for text, comment_id in texts if text not in cached]
+
+    if use_pipe:
+        docs = (doc for doc, _ in nlp_pipeline.pipe_comments(get_nlp(), texts, batch_size=nlp_batch_size))
+    else:
+        docs = (get_nlp()(text) for text, _ in texts)
+
+    new_entries = {}
+    for doc, (text, comment_id) in zip(docs, texts):
+        objective_patterns, possessive_patterns, subjective_patterns = analyse_doc(doc)
+        result = build_result(comment_id, objective_patterns, possessive_patterns, subjective_patterns)
+        if result:
+            results.append(result)
+        new_entries[text] = detection_cache.to_cached(result)
+
+    if cache is not None and new_entries:
+        cache.put_many(new_entries)
 
     return results
 
-def process_data_from_db(table_name, batch_size=100000):  # Adjust batch size for better handling
-    session = database.create_session()
+def process_chunk(comments):
+    # Pool task: one chunk of comments, analysed with this worker's model and cache
+    return analyse_comments(comments, cache=cache, **worker_options)
 
-    try:
-        if table_name == 'test':
-            model = models.Test
-        elif table_name == 'usenet':
-            model = models.Usenet
-        elif table_name == 'reddit':
-            model = models.Reddit
-        else:
-            raise ValueError("Invalid table name. Choose 'test', 'usenet', or 'reddit'.")
-
-        total_comments = session.query(model).filter_by(has_detection=False).count()
-        logging.info(f"Processing {total_comments} comments from {table_name} table.")
-
-        for offset in range(0, total_comments, batch_size):
-            comments = session.query(model).filter_by(has_detection=False).offset(offset).limit(batch_size).all()
-            logging.info(f"Processing comments from offset {offset} to {offset + batch_size}")
-
-            if not comments:
-                logging.info("No comments fetched for the current batch.")
-                continue
+def create_pool(n_process, cache_path=None, use_pipe=True, nlp_batch_size=1000):
+    # Every worker loads the spaCy model and opens its cache once up front
+    return pipeline.spawn_pool(n_process, init_worker, (cache_path, use_pipe, nlp_batch_size))
 
-            try:
-                # Pass the list of comments to `process_comments_multiprocessing`
-                processed_data = process_comments_multiprocessing(comments) 
-                logging.info(f"Processed {len(processed_data)} comments.")
-            except Exception as e:
-                logging.error(f"Error in processing comments: {str(e)}")
-                continue
-
-            for item in processed_data:
-                record = session.query(model).filter_by(id=item['id']).first()
-                if record:
-                    record.has_detection = True
-                    record.objective_patterns = item['objective_patterns']  
-                    record.subjective_patterns = item['subjective_patterns']
-                    record.possessive_patterns = item['possessive_patterns']
-                    session.add(record)
+def process_comments_multiprocessing(comments, pool, chunksize=500):
+    results = []
+    comments = prefilter_comments(comments)
 
-            try:
-                session.commit()
-                logging.info(f"Committed changes for offset {offset}")
-            except Exception as e:
-                logging.error(f"Error during commit: {str(e)}")
-                session.rollback()
-                continue
+    # Each worker takes whole chunks of (id, text) tuples
+    chunks = [comments[start:start + chunksize] for start in range(0, len(comments), chunksize)]
+    iterator = pool.imap(process_chunk, chunks)
 
-    except Exception as e:
-        logging.error(f"Error occurred: {str(e)}")
+    with tqdm(total=len(comments), desc='Processing comments', unit=' comments') as pbar:
+        for chunk, chunk_results in zip(chunks, iterator):
+            results.extend(chunk_results)
+            pbar.update(len(chunk))
 
-    finally:
-        database.close_session(session)
+    return results
+
+def process_data_from_db(table_name, batch_size=100000, use_pipe=True, nlp_batch_size=1000, n_process=None, chunksize=500, collapse_near_duplicates=False,
+                         cache_path=detection_cache.DEFAULT_CACHE_PATH, queue_size=2):  # Adjust batch size for better handling
+    n_process = n_process or multiprocessing.cpu_count()
+    # One pool for the whole run, started before the session exists so it does not inherit its connection
+    pool = create_pool(n_process, cache_path, use_pipe, nlp_batch_size) if n_process > 1 else None
+    # Pool workers open their own caches; a single process analyses here with this one
+    cache = detection_cache.DetectionCache('ob_sub', RULESET_VERSION, cache_path) if pool is None and cache_path else None
+
+    model = batch_io.get_model(table_name)
 
-    logging.info(f"Processing complete. Updated records in {table_name} table.")
+    def process_rows(rows):
+        comments = [(row.id, row.comment) for row in rows]
+        if pool is None:
+            return analyse_comments(prefilter_comments(comments), use_pipe, nlp_batch_size, cache)
+        # Spread the batch over the pool's workers in chunks
+        return process_comments_multiprocessing(comments, pool, chunksize)
+
+    try:
+        # Only rows not yet parsed by the current ruleset; `has_detection` alone cannot tell,
+        # since it stays False for rows without a detection. Rows without a detection,
+        # including prefiltered ones, get NO_DETECTION
+        pipeline.process_table(
+            model, [batch_io.needs_processing(model.detection_version, RULESET_VERSION)], process_rows,
+            [('detection_version', RULESET_VERSION, list(NO_DETECTION))], NO_DETECTION, batch_size=batch_size,
+            collapse_near_duplicates=collapse_near_duplicates, queue_size=queue_size
+        )
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        if cache:
+            cache.close()
     
 if __name__ == '__main__':
     table_to_analyse = input("Enter the table to analyse (test/usenet/reddit): ").strip().lower()
@@ -0,0 +1,43 @@
+import os
+import multiprocessing
+from tqdm import tqdm
+
+def list_input_files(input_dir, suffix=".json"):
+    # Sorted, so every run sees the files (and writes checkpoints) in the same order
+    return sorted(os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.endswith(suffix))
+
+def run_parallel(worker, tasks, workers=None, on_result=None, desc="Processing files", unit="file", keep_results=True):
+    """
+    Run `worker` on every task across a process pool, handing results back in task order.
+    Tasks finish in any order, but `on_result` (for example, writing a checkpoint) is only
+    called once every earlier task has completed, so its effects are deterministic.
+    Args:
+        worker: Picklable function taking one task.
+        tasks: List of tasks, e.g. file paths.
+        workers: Number of worker processes; defaults to the CPU count. 1 runs in-process.
+        on_result: Optional callback taking (task, result), called in task order.
+        desc: Progress bar label.
+        unit: Progress bar unit.
+        keep_results: Whether to collect the results; turn off when `on_result` consumes them.
+    Returns:
+        list: The worker results, in task order; empty when `keep_results` is off.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    results = []
+
+    def collect(iterator):
+        for task, result in zip(tasks, tqdm(iterator, total=len(tasks), desc=desc, unit=unit)):
+            if on_result:
+                on_result(task, result)
+            if keep_results:
+                results.append(result)
+
+    if workers == 1 or len(tasks) <= 1:
+        collect(map(worker, tasks))
+        return results
+
+    with multiprocessing.Pool(processes=min(workers, len(tasks))) as pool:
+        # One task per dispatch: files vary wildly in size, so larger chunks would idle workers
+        collect(pool.imap(worker, tasks, chunksize=1))
+
+    return results
@@ -0,0 +1,117 @@
+import os
+import argparse
+from functools import partial
+from datetime import datetime, timezone
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import database
+import batch_io
+import bulk_loader
+import dedup
+import parallel_ingest
+import text_cleaning
+from text_cleaning import clean_texts
+
+DEFAULT_PARQUET_PATH = '/home/joe/reddit_dataset.parquet'
+
+# Only these columns are read from disk
+COLUMNS = ['body', 'created_utc']
+REMOVED_BODIES = pa.array(['[deleted]', '[removed]'])
+
+def filter_removed(table):
+    # Drop missing, deleted and removed comments before any text reaches Python
+    body = table['body']
+    keep = pc.and_(pc.is_valid(body), pc.invert(pc.is_in(body, value_set=REMOVED_BODIES)))
+    return table.filter(pc.fill_null(keep, False))
+
+def format_dates(created_utc):
+    # Epoch seconds, stored as integers or strings depending on the dump, to the cleaners' date format
+    seconds = pc.cast(pc.cast(created_utc, pa.float64()), pa.int64(), safe=False)
+    timestamps = pc.cast(seconds, pa.timestamp('s', tz='UTC'))
+    # post_date cannot be NULL; like the Usenet cleaner, undated comments get the current datetime
+    timestamps = pc.fill_null(timestamps, pa.scalar(datetime.now(timezone.utc), pa.timestamp('s', tz='UTC')))
+    return pc.strftime(timestamps, format='%Y-%m-%d %H:%M:%S')
+
+def clean_row_group(task, tokenizer='regex'):
+    """
+    Read one row group, projecting only `body` and `created_utc`, and clean its comments.
+    Args:
+        task: Tuple of (path, row group index).
+        tokenizer: The tokenizer backend, 'regex' or 'nltk'.
+    Returns:
+        list of tuples: (post_date, cleaned comment) for each comment left non-empty by cleaning.
+    """
+    path, index = task
+    table = filter_removed(pq.ParquetFile(path).read_row_group(index, columns=COLUMNS))
+
+    dates = format_dates(table['created_utc']).to_pylist()
+    cleaned_bodies = clean_texts(table['body'].to_pylist(), tokenizer)
+    return [(date, cleaned_body) for date, cleaned_body in zip(dates, cleaned_bodies) if cleaned_body]
+
+def ingest_parquet(path=DEFAULT_PARQUET_PATH, table_name='reddit', workers=None, copy_batch_size=50000,
+                   dedup_path=dedup.DEFAULT_DEDUP_PATH, reset_dedup=False, tokenizer='regex'):
+    """
+    Clean a Reddit Parquet dump row group by row group and load it with COPY.
+    Row groups are cleaned in parallel; deduplication and loading happen in this process,
+    in row group order, so the loaded rows are the same whatever the worker count.
+    Args:
+        path: Path of the Parquet file.
+        table_name: The table to load into.
+        workers: Number of worker processes; defaults to the CPU count.
+        copy_batch_size: The number of rows per COPY and commit.
+        dedup_path: Path of the shared dedup index.
+        reset_dedup: Whether to forget the comments recorded by earlier runs first.
+        tokenizer: The tokenizer backend, 'regex' or 'nltk'.
+    Returns:
+        int: The number of rows loaded.
+    """
+    num_row_groups = pq.ParquetFile(path).num_row_groups
+    print(f"Found {num_row_groups} row groups in {path}.")
+    tasks = [(path, index) for index in range(num_row_groups)]
+
+    if reset_dedup:
+        dedup.reset(dedup_path)
+
+    with database.session_scope() as session, dedup.DedupStore(dedup_path) as dedup_store, \
+            bulk_loader.CopyLoader(session, batch_io.get_model(table_name), copy_batch_size) as loader:
+
+        def load_row_group(task, rows):
+            _, index = task
+            # Comments already kept from any other file, row group or source are dropped
+            origin = f"{os.path.basename(path)}#{index}"
+            is_new = dedup_store.filter_new([cleaned_body for _, cleaned_body in rows], origin, range(len(rows)))
+            for (post_date, cleaned_body), new in zip(rows, is_new):
+                if new:
+                    loader.add(post_date, cleaned_body)
+
+            # Each row group's rows count as kept once they are committed
+            loader.flush()
+            dedup_store.commit()
+
+        # Only the row group being loaded is kept in this process; results are not collected
+        parallel_ingest.run_parallel(partial(clean_row_group, tokenizer=tokenizer), tasks, workers,
+                                     on_result=load_row_group, desc="Cleaning row groups", unit="row group", keep_results=False)
+
+    print(f"Loaded {loader.loaded} comments into {table_name}.")
+    return loader.loaded
+
+def iter_comment_texts(path):
+    # The raw comment texts `clean_row_group` would clean, row group by row group
+    parquet_file = pq.ParquetFile(path)
+    for index in range(parquet_file.num_row_groups):
+        yield from filter_removed(parquet_file.read_row_group(index, columns=COLUMNS))['body'].to_pylist()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean a Reddit Parquet dump and load it with COPY.")
+    parser.add_argument('path', nargs='?', default=DEFAULT_PARQUET_PATH, help="Path of the Parquet file.")
+    parser.add_argument('--table', default='reddit', help="The table to load into.")
+    parser.add_argument('--workers', type=int, help="Number of worker processes; defaults to the CPU count.")
+    dedup.add_arguments(parser)
+    text_cleaning.add_arguments(parser)
+    args = parser.parse_args()
+    if args.verify_tokenizer:
+        text_cleaning.check_tokenizer(iter_comment_texts(args.path), args.tokenizer, args.verify_tokenizer)
+    else:
+        ingest_parquet(args.path, args.table, args.workers, dedup_path=args.dedup_path,
+                       reset_dedup=args.reset_dedup, tokenizer=args.tokenizer)
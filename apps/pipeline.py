@@ -0,0 +1,199 @@
+import queue
+import logging
+import threading
+import multiprocessing
+import database
+import batch_io
+import near_dedup
+
+# Marks the end of the stream on a queue
+DONE = object()
+
+def _put(target, item, stop):
+    # Blocks while the queue is full, which holds back the stage feeding it, but gives up once
+    # another stage has failed so no thread is left waiting forever
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(source, stop):
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return DONE
+
+def run_pipeline(read_batches, process_batch, write_batch, queue_size=2, url=None):
+    """
+    Run a read -> process -> write loop as three overlapping stages. A reader thread fetches
+    the next batches and a writer thread stores earlier ones while the calling thread processes
+    the current batch. The bounded queues between the stages cap the batches held in memory.
+    The reader and the writer each use their own session; batches are written in read order.
+    Worker processes used by `process_batch` must be started before this is called, or be
+    spawned rather than forked: forking while the reader and writer hold sessions and locks
+    can leave the children with broken copies of them.
+    Args:
+        read_batches: Function taking the reader's session and returning an iterable of batches.
+        process_batch: Function taking a batch and returning its results, or None to skip it.
+        write_batch: Function taking the writer's session, a batch and its results; it commits.
+        queue_size: The maximum number of batches waiting between two stages.
+        url: The database URL; defaults to the configured database.
+    Returns:
+        int: The number of batches written.
+    """
+    to_process = queue.Queue(maxsize=queue_size)
+    to_write = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    written = [0]
+
+    def reader():
+        try:
+            with database.session_scope(url) as session:
+                for batch in read_batches(session):
+                    # End the read transaction, so it holds no snapshot while the batch waits
+                    session.commit()
+                    if not _put(to_process, batch, stop):
+                        return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(to_process, DONE, stop)
+
+    def writer():
+        try:
+            with database.session_scope(url) as session:
+                while True:
+                    item = _get(to_write, stop)
+                    if item is DONE:
+                        return
+                    batch, results = item
+                    write_batch(session, batch, results)
+                    written[0] += 1
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=reader, name='pipeline-reader', daemon=True),
+               threading.Thread(target=writer, name='pipeline-writer', daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            batch = _get(to_process, stop)
+            if batch is DONE:
+                break
+            results = process_batch(batch)
+            if results is not None and not _put(to_write, (batch, results), stop):
+                break
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        _put(to_write, DONE, stop)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+    logging.info(f"Pipeline wrote {written[0]} batches.")
+    return written[0]
+
+def spawn_pool(processes, initializer=None, initargs=()):
+    # One long-lived pool per run. Spawned rather than forked, so no worker inherits a session,
+    # connection or lock from the pipeline's threads
+    return multiprocessing.get_context('spawn').Pool(processes=processes, initializer=initializer, initargs=initargs)
+
+def process_table(model, criteria, process_rows, results, defaults=None, columns=None, batch_size=10000,
+                  collapse_near_duplicates=False, queue_size=2, description=None):
+    """
+    Run a detector over the rows of a comment table that still need it, through `run_pipeline`.
+    Each batch's results are written back in one executemany UPDATE keyed on `id` and committed;
+    a batch that fails to process or write is logged and left for the next run.
+    Args:
+        model: The SQLAlchemy model class for the table.
+        criteria: Filter expressions selecting the rows still to process.
+        process_rows: Function taking a batch of rows and returning a list of result dicts,
+            each holding an `id` and the column values to set.
+        results: List of (version column name, current version, names of the result columns
+            it versions, including itself), one per ruleset the detector applies.
+        defaults: Column values for the rows of a batch without a result; None when
+            `process_rows` returns one for every row.
+        columns: The columns to read; defaults to `id` and `comment`.
+        batch_size: The number of rows read and written per batch.
+        collapse_near_duplicates: Whether to process only cluster representatives and copy
+            their results to the rest of each cluster, including members clustered after
+            their representative was processed.
+        queue_size: The maximum number of batches waiting to be processed or written.
+        description: What is run, for the logs.
+    Returns:
+        int: The number of batches written.
+    """
+    table_name = model.__tablename__
+    columns = columns or [model.id, model.comment]
+    result_columns = [column for _, _, group in results for column in group]
+    criteria = list(criteria)
+    if collapse_near_duplicates:
+        # Only one comment per cluster is processed
+        criteria.append(near_dedup.representatives_only(model))
+
+    def read_batches(session):
+        total_comments = session.query(model).filter(*criteria).count()
+        logging.info(f"Processing {total_comments} comments from {table_name} table"
+                     f"{f' with {description}' if description else ''}.")
+        # Paging on `id` rather than OFFSET
+        return batch_io.stream_rows(session, model, columns, batch_size, *criteria)
+
+    def process_batch(rows):
+        logging.info(f"Processing comments with ids {rows[0].id} to {rows[-1].id}")
+        try:
+            results = process_rows(rows)
+            logging.info(f"Processed {len(results)} comments.")
+            return results
+        except Exception as e:
+            logging.error(f"Error in processing comments: {str(e)}")
+            return None
+
+    def write_batch(session, rows, results):
+        first_id, last_id = rows[0].id, rows[-1].id
+        comment_ids = [row.id for row in rows]
+        try:
+            if defaults is None:
+                batch_io.bulk_update(session, model, results)
+            else:
+                batch_io.write_results(session, model, comment_ids, results, defaults)
+            if collapse_near_duplicates:
+                near_dedup.fan_out_results(session, model, result_columns, comment_ids)
+            session.commit()
+            logging.info(f"Committed changes for ids {first_id} to {last_id}")
+        except Exception as e:
+            logging.error(f"Error during commit: {str(e)}")
+            session.rollback()
+
+    written = 0
+    try:
+        # The next batch is fetched and the previous one written while this one is processed
+        written = run_pipeline(read_batches, process_batch, write_batch, queue_size)
+    except Exception as e:
+        logging.error(f"Error occurred: {str(e)}")
+
+    if collapse_near_duplicates:
+        try:
+            with database.session_scope() as session:
+                for version_column, version, group in results:
+                    updated = near_dedup.fan_out_to_stale_members(session, model, group, version_column, version)
+                    session.commit()
+                    logging.info(f"Copied {version_column} results to {updated} rows clustered after their representative.")
+        except Exception as e:
+            logging.error(f"Error copying results to new cluster members: {str(e)}")
+
+    logging.info(f"Processing complete. Updated records in {table_name} table.")
+    return written
@@ -1,103 +1,120 @@
 import os
-import json
-import string
-import re
+import argparse
 import nltk
-import contractions
-from nltk.tokenize import word_tokenize
+from functools import partial
 from tqdm import tqdm
 from datetime import datetime, timezone
-import models
 import database
+import json_stream
+import text_cleaning
+from text_cleaning import clean_texts
+import batch_io
+import bulk_loader
+import parallel_ingest
+import dedup
 
 # Download required NLTK resources
-nltk.download('punkt')
 nltk.download('stopwords')
 
-def clean_text(text):
-    cleaning_rules = [
-        (r"http[s]?://[^\s]+", ""),  # Remove URLs
-        (r"\b\w*\.\w+\b", ""),  # Remove words with periods
-        (r"\b\w*[-–—]+\w*\b", ""),  # Remove words with hyphens and dashes
-        (r"\s+", " "),  # Remove repeated spaces
-        (r"[^a-zA-Z\s]", ""),  # Keep only alphabetic characters and spaces
-    ]
-    
-    # Apply cleaning rules
-    for pattern, replacement in cleaning_rules:
-        text = re.sub(pattern, replacement, text)
-    
-    text = text.lower()
-    text = contractions.fix(text)
-    text = text.translate(str.maketrans('', '', string.punctuation))
-    words = word_tokenize(text)
-    return ' '.join(words)
-
-
 def convert_utc_to_date(utc_timestamp):
     return datetime.fromtimestamp(int(utc_timestamp), tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
 
-def process_file(input_file, session):
-    print(f"Processing file: {input_file}")
-    with open(input_file, 'r') as file:
-        data = json.load(file)
+def clean_batch(batch, dedup_store, origin, first_position=0, tokenizer='regex'):
+    entries = []
 
-    cleaned_data = []
-    seen_comments = set()
-
-    for i, item in enumerate(tqdm(data, desc="Cleaning comments", unit="comment")):
+    for position, item in enumerate(batch, first_position):
         body = item.get('body', '')
 
-        if body in ['[deleted]', '[removed]'] or body in seen_comments:
+        if body in ['[deleted]', '[removed]']:
             continue
 
-        cleaned_body = clean_text(body)
+        entries.append((body, item, position))
+
+    # Clean the comment texts of the whole batch at once
+    cleaned_bodies = clean_texts([body for body, _, _ in entries], tokenizer)
+
+    kept = [(item, cleaned_body, position)
+            for (_, item, position), cleaned_body in zip(entries, cleaned_bodies) if cleaned_body]
 
-        if cleaned_body:
+    # Comments already kept from any other file or source are dropped
+    is_new = dedup_store.filter_new([cleaned_body for _, cleaned_body, _ in kept], origin,
+                                    [position for _, _, position in kept])
+
+    cleaned_data = []
+    for (item, cleaned_body, _), new in zip(kept, is_new):
+        if new:
             date = convert_utc_to_date(item.get('created_utc', ''))
             cleaned_data.append({'date': date, 'comment': cleaned_body})
-            seen_comments.add(body)
-
-    # Insert cleaned data into the test table
-    for data_entry in cleaned_data:
-        test_entry = models.Test(
-            forum_name=None,  # Set to None or provide a forum name if available
-            post_date=data_entry['date'],
-            comment=data_entry['comment'],
-            has_subjective=False,
-            subjective_patterns=[]
-        )
-        session.add(test_entry)
-    session.commit()
-
-    # Save cleaned data to a JSON file
+
+    return cleaned_data
+
+def process_file(input_file, session, table_name='test', batch_size=10000, copy_batch_size=50000,
+                 dedup_path=dedup.DEFAULT_DEDUP_PATH, tokenizer='regex'):
+    print(f"Processing file: {input_file}")
+
+    # Save cleaned data to a JSON file as it is produced
     filename = os.path.basename(input_file)
     output_file = os.path.join(f"cleaned_{filename}")
-    with open(output_file, 'w') as cleaned_file:
-        json.dump(cleaned_data, cleaned_file, indent=4)
-
 
-def main():
+    # Cleaned rows are streamed into the target table with COPY, committed every `copy_batch_size` rows
+    loader = bulk_loader.CopyLoader(session, batch_io.get_model(table_name), copy_batch_size)
+
+    records = tqdm(json_stream.iter_records(input_file), desc="Cleaning comments", unit="comment")
+    with dedup.DedupStore(dedup_path) as dedup_store:
+        with open(output_file, 'w') as cleaned_file, json_stream.JsonArrayWriter(cleaned_file) as writer, loader:
+            position = 0
+            for batch in json_stream.batched(records, batch_size):
+                for data_entry in clean_batch(batch, dedup_store, filename, position, tokenizer):
+                    loader.add(data_entry['date'], data_entry['comment'])
+                    writer.write(data_entry)
+                position += len(batch)
+
+        # The loader has flushed and committed its last rows; only now do they count as kept
+        dedup_store.commit()
+
+def process_file_in_worker(input_file, table_name='test', dedup_path=dedup.DEFAULT_DEDUP_PATH, tokenizer='regex'):
+    # Sessions cannot cross process boundaries, so every worker opens its own
+    with database.session_scope() as session:
+        process_file(input_file, session, table_name, dedup_path=dedup_path, tokenizer=tokenizer)
+
+def iter_comment_texts(json_files):
+    # The raw comment texts `clean_batch` would clean, file by file
+    for input_file in json_files:
+        for item in json_stream.iter_records(input_file):
+            body = item.get('body', '')
+            if body not in ['[deleted]', '[removed]']:
+                yield body
+
+def main(table_name='test', workers=None, dedup_path=dedup.DEFAULT_DEDUP_PATH, reset_dedup=False,
+         tokenizer='regex', verify_tokenizer=None):
     input_folder_path = os.getcwd() + '/data/reddit/extracted'
     # input_dir = "/home/joe/Desktop/diss_project/dataset/reddit_data/extracted"
     # # output_dir = "/home/joe/Desktop/diss_project/dataset/reddit_data/clean"
 
-    json_files = [os.path.join(input_folder_path, f) for f in os.listdir(input_folder_path) if f.endswith(".json")]
+    json_files = parallel_ingest.list_input_files(input_folder_path)
 
     print(f"Found {len(json_files)} JSON files to process.")
 
-    # Create a session
-    session = database.create_session()
+    if verify_tokenizer:
+        text_cleaning.check_tokenizer(iter_comment_texts(json_files), tokenizer, verify_tokenizer)
+        return
 
-    for filename in tqdm(json_files, desc="Processing files", unit="file"):
-        process_file(filename, session)
+    if reset_dedup:
+        dedup.reset(dedup_path)
 
-    # Close the session
-    session.close()
+    parallel_ingest.run_parallel(partial(process_file_in_worker, table_name=table_name, dedup_path=dedup_path,
+                                         tokenizer=tokenizer),
+                                 json_files, workers)
 
     print("Data cleaning complete. Cleaned files are saved in the output directory.")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Clean the Reddit JSON dumps and load them with COPY.")
+    parser.add_argument('--table', default='test', help="The table to load into.")
+    parser.add_argument('--workers', type=int, help="Number of worker processes; defaults to the CPU count.")
+    dedup.add_arguments(parser)
+    text_cleaning.add_arguments(parser)
+    args = parser.parse_args()
+    main(args.table, args.workers, args.dedup_path, args.reset_dedup, args.tokenizer, args.verify_tokenizer)
@@ -0,0 +1,277 @@
+import re
+import random
+import string
+import contractions
+from itertools import islice
+
+# Cleaning rules, compiled once and applied in this order. Each removal can create new word
+# boundaries for the rules after it, so the first three cannot share a pass without changing output.
+URL_RULE = re.compile(r"http[s]?://[^\s]+")  # Remove URLs
+DOTTED_WORD_RULE = re.compile(r"\b\w*\.\w+\b")  # Remove words with periods
+DASHED_WORD_RULE = re.compile(r"\b\w*[-–—]+\w*\b")  # Remove words with hyphens and dashes
+WHITESPACE_RULE = re.compile(r"\s+")  # Remove repeated spaces
+NON_ALPHA_RULE = re.compile(r"[^a-zA-Z\s]+")  # Keep only alphabetic characters and spaces
+
+# Built once instead of on every call
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+# The NLTK Treebank rules that can fire on text made only of letters, whitespace, apostrophes
+# and hyphens, in the order `word_tokenize` applies them. Every other rule needs a character
+# the cleaners have already removed, so on such text the result is identical to NLTK.
+QUOTE_RULES = [
+    (re.compile(r"([ \(\[{<])(\"|\'{2})"), r"\1 `` "),
+    (re.compile(r"(?i)(\')(?!re|ve|ll|m|t|s|d|n)(\w)\b"), r"\1 \2"),
+    (re.compile(r"([^'])' "), r"\1 ' "),
+    (re.compile(r"--"), r" -- "),
+]
+ENDING_QUOTE_RULES = [
+    (re.compile(r"''"), " '' "),
+    (re.compile(r"([^' ])('[sS]|'[mM]|'[dD]|') "), r"\1 \2 "),
+    (re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) "), r"\1 \2 "),
+]
+CONTRACTION_RULES = [
+    re.compile(r"(?i)\b(can)(not)\b"),
+    re.compile(r"(?i)\b(d)('ye)\b"),
+    re.compile(r"(?i)\b(gim)(me)\b"),
+    re.compile(r"(?i)\b(gon)(na)\b"),
+    re.compile(r"(?i)\b(got)(ta)\b"),
+    re.compile(r"(?i)\b(lem)(me)\b"),
+    re.compile(r"(?i)\b(more)('n)\b"),
+    re.compile(r"(?i)\b(wan)(na)(?=\s)"),
+    re.compile(r"(?i) ('t)(is)\b"),
+    re.compile(r"(?i) ('t)(was)\b"),
+]
+# Letters-only words NLTK splits in two; anything else is split on whitespace alone
+SPLIT_WORDS = re.compile(r"(?i)\b(?:cannot|gimme|gonna|gotta|lemme|wanna)\b")
+
+def regex_tokenize(text):
+    """
+    Tokenize already-normalized text the way NLTK's `word_tokenize` does, without Punkt.
+    Only valid for text made of letters, whitespace, apostrophes and hyphens.
+    """
+    if "'" not in text and '-' not in text:
+        if not SPLIT_WORDS.search(text):
+            return text.split()
+        text = " " + text + " "
+    else:
+        for regexp, substitution in QUOTE_RULES:
+            text = regexp.sub(substitution, text)
+        text = " " + text + " "
+        for regexp, substitution in ENDING_QUOTE_RULES:
+            text = regexp.sub(substitution, text)
+
+    for regexp in CONTRACTION_RULES:
+        text = regexp.sub(r" \1 \2 ", text)
+    return text.split()
+
+def nltk_tokenize(text):
+    # Imported on first use, so the regex backend never pays for NLTK. Normalized text has no
+    # sentence-ending punctuation, so splitting into sentences first (which needs Punkt) changes nothing.
+    import nltk
+    return nltk.word_tokenize(text, preserve_line=True)
+
+TOKENIZERS = {
+    'regex': regex_tokenize,
+    'nltk': nltk_tokenize,
+}
+
+def get_tokenizer(name):
+    try:
+        return TOKENIZERS[name]
+    except KeyError:
+        raise ValueError(f"Invalid tokenizer '{name}'. Choose one of: {', '.join(TOKENIZERS)}.")
+
+def verify_tokenizer(texts, name='regex', sample_size=1000, seed=0):
+    """
+    Check that a tokenizer backend agrees with NLTK's `word_tokenize` on a sample of texts.
+    Args:
+        texts: List of texts to sample from, normalized the same way as in the cleaners.
+        name: The tokenizer backend to check.
+        sample_size: The maximum number of texts to compare.
+        seed: Seed for the sample, so a check can be repeated.
+    Returns:
+        list of tuples: Each tuple contains (text, backend_tokens, nltk_tokens) for a disagreement.
+    """
+    tokenize = get_tokenizer(name)
+    sample = texts if len(texts) <= sample_size else random.Random(seed).sample(texts, sample_size)
+
+    mismatches = []
+    for text in sample:
+        tokens, expected = tokenize(text), nltk_tokenize(text)
+        if tokens != expected:
+            mismatches.append((text, tokens, expected))
+
+    print(f"Tokenizer '{name}' agreed with NLTK on {len(sample) - len(mismatches)} of {len(sample)} sampled texts.")
+    return mismatches
+
+def check_tokenizer(texts, name='regex', sample_size=1000):
+    """
+    Run `verify_tokenizer` on raw comments, normalized as `clean_text` does before tokenizing,
+    and print the first disagreements.
+    Args:
+        texts: Iterable of raw comment texts; only the first `10 * sample_size` are read.
+        name: The tokenizer backend to check.
+        sample_size: The number of texts to compare.
+    Returns:
+        list of tuples: Each tuple contains (text, backend_tokens, nltk_tokens) for a disagreement.
+    """
+    normalized = [normalize_text(text) for text in islice(texts, 10 * sample_size)]
+    mismatches = verify_tokenizer(normalized, name, sample_size)
+    for text, tokens, expected in mismatches[:10]:
+        print(f"{text!r}\n  {name}: {tokens}\n  nltk: {expected}")
+    return mismatches
+
+def add_arguments(parser):
+    parser.add_argument('--tokenizer', choices=list(TOKENIZERS), default='regex',
+                        help="Tokenizer backend used by the cleaning.")
+    parser.add_argument('--verify-tokenizer', type=int, nargs='?', const=1000, metavar='N',
+                        help="Instead of cleaning, compare the tokenizer with NLTK on N comments from the "
+                             "input (1000 if N is not given) and print any disagreements.")
+
+def normalize_text(text):
+    # Everything `clean_text` does before tokenizing
+    text = URL_RULE.sub("", text)
+    text = DOTTED_WORD_RULE.sub("", text)
+    text = DASHED_WORD_RULE.sub("", text)
+    text = WHITESPACE_RULE.sub(" ", text)
+    text = NON_ALPHA_RULE.sub("", text)
+
+    text = text.lower()
+    text = contractions.fix(text)
+    return text.translate(PUNCTUATION_TABLE)
+
+def clean_text(text, tokenizer='regex'):
+    words = get_tokenizer(tokenizer)(normalize_text(text))
+    return ' '.join(words)
+
+def clean_texts(texts, tokenizer='regex'):
+    """
+    Clean a batch of comments, cleaning each distinct text only once.
+    Args:
+        texts: List of raw comment texts.
+        tokenizer: The tokenizer backend, 'regex' or 'nltk'.
+    Returns:
+        list: The cleaned texts, in the same order as `texts`.
+    """
+    cleaned = {}
+    for text in texts:
+        if text not in cleaned:
+            cleaned[text] = clean_text(text, tokenizer)
+    return [cleaned[text] for text in texts]
+
+# Usenet posts start with an RFC 822 style header block ("Name: value" lines, with indented
+# continuation lines) that ends at the first blank line; quoted replies start with '>'
+HEADER_LINE = re.compile(r"^[!-9;-~]+:(?:\s|$)")
+# A leading block only counts as headers if it names at least one of these, so a body that
+# opens with a line like "Note: ..." keeps it
+USENET_HEADER_NAME = re.compile(
+    r"^(?:From|Subject|Newsgroups|Path|Message-ID|Date|References|Organization|Lines|Sender|Reply-To|"
+    r"Followup-To|Xref|MIME-Version|Content-Type|Content-Transfer-Encoding|User-Agent|NNTP-[\w-]+|X-[\w-]+):",
+    re.IGNORECASE
+)
+
+def _split_header_block(lines):
+    # The header lines at the start of a post and the index of its first body line
+    headers = []
+    position = 0
+    while position < len(lines):
+        line = lines[position]
+        if HEADER_LINE.match(line):
+            headers.append(line)
+        elif headers and line[:1] in (' ', '\t') and line.strip():
+            headers[-1] += '\n' + line
+        else:
+            break
+        position += 1
+
+    if headers and (position == len(lines) or not lines[position].strip()) \
+            and any(USENET_HEADER_NAME.match(header) for header in headers):
+        # Skip the blank line closing the block
+        return headers, position + 1
+    return [], 0
+
+def is_quoted_line(line):
+    return line.lstrip().startswith('>')
+
+def split_usenet_post(post):
+    """
+    Split a raw Usenet post into its header block, its own body text and its quoted reply lines.
+    The header block must end at a blank line or the end of the post and name a Usenet header;
+    otherwise the whole post is body and quotes.
+    Args:
+        post: The raw post text.
+    Returns:
+        tuple: (header lines, body text, quoted lines).
+    """
+    lines = post.splitlines()
+    headers, position = _split_header_block(lines)
+
+    body, quoted = [], []
+    for line in lines[position:]:
+        if is_quoted_line(line):
+            quoted.append(line)
+        else:
+            body.append(line)
+
+    return headers, '\n'.join(body), quoted
+
+def strip_usenet_headers(post):
+    # The post without its header block, quoted replies included
+    lines = post.splitlines()
+    _, position = _split_header_block(lines)
+    return '\n'.join(lines[position:]) if position else post
+
+def strip_quoted_lines(text):
+    return '\n'.join(line for line in text.splitlines() if not is_quoted_line(line))
+
+# Usenet body rules, compiled once and applied in this order
+USENET_URL_RULE = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+USENET_DOTTED_WORD_RULE = re.compile(r'\b\w*\.\w+\b')
+USENET_HYPHENATED_WORD_RULE = re.compile(r'\b\w*-\w+\b')
+USENET_PUNCTUATED_WORD_RULE = re.compile(r'\b\w*[\.,;\'"!?]+\w+\b')
+USENET_CAPITALS_RULE = re.compile(r'\b[A-Z]+\b')
+USENET_REPLY_TO_RULE = re.compile(r'^\s*Reply-To [^\w\s]+\s*$')
+USENET_WORD_RULE = re.compile(r'\b([a-zA-Z]+)\b')
+USENET_CHARSET_RULE = re.compile(r"[^a-zA-Z\s'-]+")
+
+# Everything from the first signature marker or header name onwards is dropped. Once the text
+# is all lowercase only the alternatives without capitals can match, so they get their own pattern.
+USENET_TRAILER_RULE = re.compile(r'(--|Xref|X-Google-ArrivalTime|-- PST|Reply-To|X-Antivirus|MIME-Version|X-Usenet-Provider|X-Face|X-No-Archive|X-Plain|X-It-Strategy|X-Antivirus-Status|VPS|logging-data|X-Abuse-and-DMCA-Info|Injection-|From|X-Google-Thread|X-Google-Attributes|X-Google-NewGroupId|X-Google-Language|Received|Path|From|Newsgroups:|alt.politics.communism|Subject|Organization|Lines|Message-ID|NNTP-Posting-Host|Mime-Version|X-Trace|X-Complaints-To|NNTP-Posting-Date|Complaints-To|Injection-Info|posting-account|User-Agent|Bytes|Content-Type|Content-Transfer-Encoding|References|X-Priority|X-MSMail-Priority|X-Newsreader|X-MimeOLE|NNTP-Posting-).*')
+USENET_LOWERCASE_TRAILER_RULE = re.compile(r'(--|logging-data|posting-account|alt.politics.communism).*')
+
+# Word characters other than ASCII letters; without any, every run of ASCII letters is a whole word
+NON_ASCII_LETTER_WORD_CHAR = re.compile(r'[^\WA-Za-z]')
+ASCII_LOWERCASE_TABLE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def _lower_match(match):
+    return match.group(0).lower()
+
+def normalize_usenet_comment(comment):
+    """
+    Normalize a Usenet comment ahead of tokenization: expand contractions, drop URLs, dotted,
+    hyphenated and punctuated words and all-capital words, lowercase, keep only letters,
+    whitespace, apostrophes and hyphens, and cut the text at the first signature marker.
+    Args:
+        comment: The comment text.
+    Returns:
+        str: The normalized text, on a single line.
+    """
+    comment = contractions.fix(comment)
+    comment = USENET_URL_RULE.sub('', comment)
+    comment = USENET_DOTTED_WORD_RULE.sub('', comment)
+    comment = USENET_HYPHENATED_WORD_RULE.sub('', comment)
+    comment = USENET_PUNCTUATED_WORD_RULE.sub('', comment)
+    comment = USENET_CAPITALS_RULE.sub('', comment)
+    comment = WHITESPACE_RULE.sub(' ', comment)
+    comment = USENET_REPLY_TO_RULE.sub('', comment)
+
+    if NON_ASCII_LETTER_WORD_CHAR.search(comment):
+        # A letter run touching a digit, underscore or non-ASCII letter is not a whole word
+        # and keeps its case, so capitals can survive into the trailer rule
+        comment = USENET_WORD_RULE.sub(_lower_match, comment)
+        comment = USENET_CHARSET_RULE.sub('', comment)
+        return USENET_TRAILER_RULE.sub('', comment)
+
+    comment = comment.translate(ASCII_LOWERCASE_TABLE)
+    comment = USENET_CHARSET_RULE.sub('', comment)
+    return USENET_LOWERCASE_TRAILER_RULE.sub('', comment)
@@ -1,70 +1,67 @@
 import os
-import json
-import re
+import argparse
 import nltk
-import contractions
 from nltk.corpus import words
 from tqdm import tqdm
-from nltk.tokenize import word_tokenize
-from dateutil import parser as date_parser
 from dateutil import tz
 import database
 import models
 import datetime
-import multiprocessing
+import json_stream
+import text_cleaning
+import date_parsing
+import parallel_ingest
+import dedup
+import migrations
+from itertools import islice
+from functools import partial
 
 nltk.download('words')
 english_words = set(words.words())
 
 class DatasetCleaner:
-    def __init__(self, session, model, batch_size=1000):
+    def __init__(self, session, model, batch_size=1000, tokenizer='regex', strip_headers=True, dedup_store=None,
+                 date_normalizer=None, strip_quotes=False):
         self.session = session
+        self.dedup_store = dedup_store
+        # Pass one in to share its cache of parsed date strings across files
+        self.date_normalizer = date_normalizer or date_parsing.DateNormalizer()
         self.model = model
         self.batch_size = batch_size
+        self.tokenize = text_cleaning.get_tokenizer(tokenizer)
+        self.strip_headers = strip_headers
+        self.strip_quotes = strip_quotes
 
     def clean_dataset_multiprocessing(self, filename, last_processed_index=0):
         forum_name = self._extract_forum_name(filename)
-        with open(filename, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            cleaned_data = self._clean_json_data(data, forum_name, last_processed_index)
-            non_empty_comments = [entry for entry in cleaned_data if 'comment' in entry and entry['comment'].strip() != '']
-            self._save_to_database_multiprocessing(non_empty_comments, forum_name, last_processed_index)
+        # Records are streamed from the file, cleaned and saved batch by batch
+        data = json_stream.iter_records(filename)
+        cleaned_data = self._clean_json_data(data, forum_name, last_processed_index)
+        non_empty_comments = ((i, entry) for i, entry in cleaned_data if 'comment' in entry and entry['comment'].strip() != '')
+        self._save_to_database_multiprocessing(non_empty_comments, forum_name, os.path.basename(filename))
 
     def _extract_forum_name(self, filename):
         forum_name = os.path.basename(filename).split('_')[1]
         return forum_name
 
     def _clean_json_data(self, data, forum_name, last_processed_index):
-        cleaned_data = []
-        for i, entry in enumerate(tqdm(data, desc=f"Cleaning {forum_name} comments", unit="comment")):
-            if i < last_processed_index:
-                continue
+        # Yield (index in file, entry) pairs, skipping entries before the checkpoint
+        entries = islice(enumerate(data), last_processed_index, None)
+        for i, entry in tqdm(entries, desc=f"Cleaning {forum_name} comments", unit="comment"):
             if 'comment' in entry:
                 entry['comment'] = self._clean_comment(entry['comment'])
-            cleaned_data.append(entry)
-        return cleaned_data
+            yield i, entry
 
     def _clean_comment(self, comment):
-        comment = contractions.fix(comment)
-        cleaning_rules = [
-            (r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', ''),
-            (r'\b\w*\.\w+\b', ''),
-            (r'\b\w*-\w+\b', ''),
-            (r'\b\w*[\.,;\'"!?]+\w+\b', ''),
-            (r'\b[A-Z]+\b', ''),
-            (r'\s+', ' '),
-            (r'^\s*Reply-To [^\w\s]+\s*$', ''),
-            (r'\b([a-zA-Z]+)\b', lambda match: match.group(0).lower()),
-            (r'[^a-zA-Z\s\'-]', ''),
-            (r'\S+@\S+', ''),
-            (r'X-Google-Thread:.*', ''),
-            (r'(--|Xref|X-Google-ArrivalTime|-- PST|Reply-To|X-Antivirus|MIME-Version|X-Usenet-Provider|X-Face|X-No-Archive|X-Plain|X-It-Strategy|X-Antivirus-Status|VPS|logging-data|X-Abuse-and-DMCA-Info|Injection-|From|X-Google-Thread|X-Google-Attributes|X-Google-NewGroupId|X-Google-Language|Received|Path|From|Newsgroups:|alt.politics.communism|Subject|Organization|Lines|Message-ID|NNTP-Posting-Host|Mime-Version|X-Trace|X-Complaints-To|NNTP-Posting-Date|Complaints-To|Injection-Info|posting-account|User-Agent|Bytes|Content-Type|Content-Transfer-Encoding|References|X-Priority|X-MSMail-Priority|X-Newsreader|X-MimeOLE|NNTP-Posting-).*', ''),
-        ]
-
-        for pattern, replacement in cleaning_rules:
-            comment = re.sub(pattern, replacement, comment)
-
-        tokens = word_tokenize(comment)
+        if self.strip_headers:
+            comment = text_cleaning.strip_usenet_headers(comment)
+        if self.strip_quotes:
+            # Keep only the poster's own text, without the lines quoted from earlier posts
+            comment = text_cleaning.strip_quoted_lines(comment)
+
+        comment = text_cleaning.normalize_usenet_comment(comment)
+
+        tokens = self.tokenize(comment)
         tokens = [word for word in tokens if self._is_english_word(word)]
         cleaned_comment = ' '.join(tokens)
 
@@ -73,56 +70,46 @@ class DatasetCleaner:
     def _is_english_word(self, word):
         return word.lower() in english_words
 
-    def _save_to_database_multiprocessing(self, cleaned_data, forum_name, start_index):
-        with multiprocessing.Pool(processes=multiprocessing.cpu_count()) as pool:
-            results = []
-
-            iterator = pool.imap(process_comment, (entry['comment'] for entry in cleaned_data))
-
-            with tqdm(total=len(cleaned_data), desc='Processing comments', unit=' comments') as pbar:
-                for result in iterator:
-                    if result:
-                        results.append(result)
-                    pbar.update(1)
-
-            batch = []
-            for i, entry in enumerate(cleaned_data):
-                index = start_index + i
-                date_str = entry.get('date')
-                if date_str:
-                    try:
-                        post_date = date_parser.parse(date_str)
-                        if post_date.utcoffset() is not None:
-                            # Check if timezone offset is within supported range
-                            offset_hours = post_date.utcoffset().total_seconds() / 3600
-                            if abs(offset_hours) > 14:
-                                print(f"Invalid timezone offset in date '{date_str}', normalizing to UTC")
-                                post_date = post_date.astimezone(tz.UTC)
-                    except (ValueError, OverflowError) as e:
-                        print(f"Failed to parse date '{date_str}': {e}, using current datetime instead")
-                        post_date = datetime.datetime.now(tz.UTC)
-                else:
-                    post_date = datetime.datetime.now(tz.UTC)
-
-                record = self.model(
-                    post_date=post_date,
-                    comment=entry.get('comment'),
-                    forum_name=forum_name
-                )
-                batch.append(record)
-
-                if len(batch) >= self.batch_size:
-                    self.session.bulk_save_objects(batch)
-                    self.session.commit()
-                    print(f"Committed batch of {len(batch)} records to the database.")
-                    self._save_checkpoint(forum_name, index)
-                    batch.clear()
-
-            if batch:
-                self.session.bulk_save_objects(batch)
-                self.session.commit()
-                print(f"Committed final batch of {len(batch)} records to the database.")
-                self._save_checkpoint(forum_name, start_index + len(cleaned_data) - 1)
+    def _save_to_database_multiprocessing(self, cleaned_data, forum_name, origin):
+        batch = []
+        index = None
+        for index, entry in cleaned_data:
+            date_str = entry.get('date')
+            post_date = self.date_normalizer.normalize(date_str) if date_str else None
+            if post_date is None:
+                # Missing or unparseable dates get the current datetime instead
+                post_date = datetime.datetime.now(tz.UTC)
+
+            record = self.model(
+                post_date=post_date,
+                comment=entry.get('comment'),
+                forum_name=forum_name
+            )
+            batch.append((index, record))
+
+            if len(batch) >= self.batch_size:
+                self._commit_batch(batch, forum_name, origin, index)
+                batch = []
+
+        if batch:
+            self._commit_batch(batch, forum_name, origin, index)
+
+    def _commit_batch(self, batch, forum_name, origin, index):
+        records = [record for _, record in batch]
+        if self.dedup_store is not None:
+            # Comments already kept from any other file or source are dropped
+            is_new = self.dedup_store.filter_new([record.comment for record in records], origin,
+                                                 [position for position, _ in batch])
+            records = [record for record, new in zip(records, is_new) if new]
+
+        migrations.ensure_year_partitions(self.session, self.model.__tablename__, {record.post_date for record in records})
+        self.session.bulk_save_objects(records)
+        self.session.commit()
+        if self.dedup_store is not None:
+            self.dedup_store.commit()
+        print(f"Committed batch of {len(records)} records to the database.")
+        # Resume from the entry after the last one committed
+        self._save_checkpoint(forum_name, index + 1)
 
     def _save_checkpoint(self, forum_name, index):
         checkpoint_file = f"{forum_name}_checkpoint.txt"
@@ -136,8 +123,9 @@ class DatasetCleaner:
                 return int(f.read().strip())
         return 0
 
-def process_file(filename, session, model):
-    cleaner = DatasetCleaner(session, model)
+def process_file(filename, session, model, dedup_store=None, date_normalizer=None, strip_quotes=False):
+    cleaner = DatasetCleaner(session, model, dedup_store=dedup_store, date_normalizer=date_normalizer,
+                             strip_quotes=strip_quotes)
     forum_name = cleaner._extract_forum_name(filename)
     last_processed_index = cleaner._load_checkpoint(forum_name)
     cleaner.clean_dataset_multiprocessing(filename, last_processed_index)
@@ -152,28 +140,62 @@ def save_processed_file(checkpoint_file, filename):
     with open(checkpoint_file, 'a') as f:
         f.write(filename + '\n')
 
-def main():
+def process_forum_files(filenames, model=models.Usenet, dedup_path=dedup.DEFAULT_DEDUP_PATH, strip_quotes=False):
+    # Files of one forum share a checkpoint, so they are cleaned in order by the same worker,
+    # which opens its own session and its own handle on the shared dedup index. Date strings
+    # repeat across a forum's files, so they share one date cache too
+    date_normalizer = date_parsing.DateNormalizer()
+    with database.session_scope() as session, dedup.DedupStore(dedup_path) as dedup_store:
+        for filename in filenames:
+            print(f"Processing file: {filename}")
+            process_file(filename, session, model, dedup_store, date_normalizer, strip_quotes)
+            print(f"Finished processing file: {filename}")
+    date_normalizer.report()
+    return filenames
+
+def group_by_forum(filenames):
+    groups = {}
+    for filename in filenames:
+        forum_name = os.path.basename(filename).split('_')[1]
+        groups.setdefault(forum_name, []).append(filename)
+    return [groups[forum_name] for forum_name in sorted(groups)]
+
+def main(workers=None, dedup_path=dedup.DEFAULT_DEDUP_PATH, reset_dedup=False, strip_quotes=False):
     input_folder_path = os.getcwd() + '/data/usenet/extracted'
-    json_files = [os.path.join(input_folder_path, f) for f in os.listdir(input_folder_path) if f.endswith(".json")]
+    json_files = parallel_ingest.list_input_files(input_folder_path)
 
     checkpoint_file = 'processed_files.txt'
     processed_files = get_processed_files(checkpoint_file)
 
     print(f"Found {len(json_files)} JSON files to process.")
-    
-    session = database.create_session()
-
-    try:
-        for filename in tqdm(json_files, desc="Processing files", unit="file"):
-            if filename not in processed_files:
-                print(f"Processing file: {filename}")
-                process_file(filename, session, models.Usenet)
-                save_processed_file(checkpoint_file, filename)
-                print(f"Finished processing file: {filename}")
-    finally:
-        database.close_session(session)
+
+    pending = [filename for filename in json_files if filename not in processed_files]
+
+    if reset_dedup:
+        dedup.reset(dedup_path)
+
+    if strip_quotes:
+        # Quoted replies repeat text from earlier posts, but the corpus and every yearly count
+        # built from it then differ from runs that kept them
+        print("Removing quoted reply lines; counts are not comparable with tables cleaned without --strip-quotes.")
+
+    def record_processed(filenames, _):
+        for filename in filenames:
+            save_processed_file(checkpoint_file, filename)
+
+    # Finished files are recorded in sorted forum order, whichever worker finishes first
+    parallel_ingest.run_parallel(partial(process_forum_files, dedup_path=dedup_path, strip_quotes=strip_quotes),
+                                 group_by_forum(pending), workers,
+                                 on_result=record_processed, desc="Processing forums", unit="forum")
 
     print("Data cleaning complete. Cleaned data is saved in the database.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Clean the Usenet JSON dumps into the usenet table.")
+    parser.add_argument('--workers', type=int, help="Number of worker processes; defaults to the CPU count.")
+    parser.add_argument('--strip-quotes', action='store_true',
+                        help="Also remove '>' quoted reply lines. This changes the cleaned corpus, and so every "
+                             "count built from it, compared with runs without it.")
+    dedup.add_arguments(parser)
+    args = parser.parse_args()
+    main(args.workers, args.dedup_path, args.reset_dedup, args.strip_quotes)
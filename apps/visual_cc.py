@@ -1,117 +1,55 @@
+import os
 import matplotlib.pyplot as plt
 import pandas as pd
-import json  # Add this line
 from models import Usenet
 import database
+import aggregations
+import async_database
 
-# Create an engine and session
-session = database.create_session()
+# Set DISS_SNAPSHOT_DIR to read from a Parquet snapshot written by export_parquet.py instead of the database
+SNAPSHOT_DIR = os.environ.get('DISS_SNAPSHOT_DIR')
 
-# Query data from table
-def query_data(table_class):
+# Aggregate the counts per year in the database, or in a Parquet snapshot of it
+def query_yearly_counts(table_class, label, snapshot_dir=SNAPSHOT_DIR):
     """
-    Query data from a table and return post dates, construct patterns, and comment counts.
+    Query construct pattern counts, detected comment counts and total comment counts per year.
     Args:
         table_class: The SQLAlchemy model class for the table to query.
+        label: The source label for the table, e.g. 'Usenet'.
+        snapshot_dir: Optional Parquet snapshot directory to read from instead of the database.
     Returns:
-        list of tuples: Each tuple contains (post_date, construct_patterns, comment_count).
+        list of dicts: One per year with source, year, construct_patterns, comment_count and total_comments.
     """
+    pattern_columns = {'construct_patterns': table_class.construct_patterns}
     try:
-        results = session.query(
-            table_class.post_date,
-            table_class.construct_patterns
-        ).filter(table_class.has_detection_cc == True).all()
-        print(f"Query returned {len(results)} results.")
+        if snapshot_dir:
+            return aggregations.yearly_pattern_counts_from_snapshot(
+                snapshot_dir, table_class, label, pattern_columns, table_class.has_detection_cc
+            )
+        if async_database.is_available():
+            # One query per year, several at once on separate connections
+            return async_database.run(async_database.yearly_pattern_counts(
+                table_class, label, pattern_columns, table_class.has_detection_cc
+            ))
+        with database.session_scope() as session:
+            return aggregations.yearly_pattern_counts(session, table_class, label, pattern_columns, table_class.has_detection_cc)
     except Exception as e:
         print(f"Error querying data: {e}")
         return []
 
-    # Aggregate the counts
-    data = {}
-    for post_date, patterns in results:
-        try:
-            # Convert to naive datetime if it's timezone-aware
-            if post_date.tzinfo is not None:
-                post_date = post_date.astimezone(None)  # Convert to naive datetime
-
-            if post_date not in data:
-                data[post_date] = {'construct_patterns': 0, 'comment_count': 0}
-            if patterns:
-                data[post_date]['construct_patterns'] += len(json.loads(patterns))
-            data[post_date]['comment_count'] += 1
-        except Exception as e:
-            print(f"Skipping invalid date: {post_date} due to error: {e}")
-
-    # Convert to list of tuples
-    return [(date, counts['construct_patterns'], counts['comment_count']) for date, counts in data.items()]
-
 # Extract data from table
-table_data = query_data(Usenet)
+table_data = query_yearly_counts(Usenet, 'Usenet')
+
+# Keep only the years with at least one detection
+yearly_df = pd.DataFrame(table_data)
+if not yearly_df.empty:
+    yearly_df = yearly_df[yearly_df['comment_count'] > 0].reset_index(drop=True)
 
 # Check if any data was retrieved
-if not table_data:
+if yearly_df.empty:
     print("No data retrieved from the query. Exiting the script.")
     exit()
 
-# Convert the results into DataFrames
-def convert_to_dataframe(data, label):
-    df = pd.DataFrame(data, columns=['post_date', 'construct_patterns', 'comment_count'])
-    df['post_date'] = pd.to_datetime(df['post_date'], utc=True, errors='coerce')  # Coerce invalid dates to NaT
-    df = df.dropna(subset=['post_date'])  # Drop rows where 'post_date' could not be parsed
-    df['year'] = df['post_date'].dt.year  # Extract year for aggregation
-    df['source'] = label
-    return df
-
-# Convert data to DataFrame 
-test_df = convert_to_dataframe(table_data, 'Usenet')
-
-# Query the total number of comments by year
-def query_total_comments(table_class):
-    try:
-        results = session.query(
-            table_class.post_date
-        ).all()
-        print(f"Total comments query returned {len(results)} results.")
-    except Exception as e:
-        print(f"Error querying total comments: {e}")
-        return []
-
-    # Aggregate the counts
-    total_comments = {}
-    for post_date, in results:
-        try:
-            # Convert to naive datetime if it's timezone-aware
-            if post_date.tzinfo is not None:
-                post_date = post_date.astimezone(None)  # Convert to naive datetime
-
-            year = post_date.year
-            if year not in total_comments:
-                total_comments[year] = 0
-            total_comments[year] += 1
-        except Exception as e:
-            print(f"Skipping invalid date: {post_date} due to error: {e}")
-
-    # Convert to list of tuples
-    return [(year, count) for year, count in total_comments.items()]
-
-# Extract total comments data
-total_comments_data = query_total_comments(Usenet)
-
-# Convert total comments to DataFrame
-total_comments_df = pd.DataFrame(total_comments_data, columns=['year', 'total_comments'])
-
-# Combine all DataFrames
-combined_df = pd.concat([test_df]) 
-
-# Aggregate by year
-yearly_df = combined_df.groupby(['source', 'year']).agg(
-    construct_patterns=('construct_patterns', 'sum'),
-    comment_count=('comment_count', 'sum')
-).reset_index()
-
-# Merge with total comments DataFrame
-yearly_df = yearly_df.merge(total_comments_df, on='year', how='left')
-
 # Calculate the normalized ratios
 yearly_df['ratio_per_comment'] = yearly_df['construct_patterns'] / yearly_df['total_comments']
 
@@ -156,6 +94,3 @@ print("Plot saved to 'ratios_by_year.png'")
 
 # Show the plot
 plt.show()
-
-# Close the session and dispose of the engine
-database.close_session(session)
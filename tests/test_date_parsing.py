@@ -0,0 +1,49 @@
+import random
+from dateutil import parser as date_parser
+from dateutil import tz
+from date_parsing import DateNormalizer
+
+DAYS = ['Mon, ', 'Tue ', 'monday, ', '', 'Sun,', 'Fri, ']
+MONTHS = ['Jan', 'feb', 'March', 'Sept', 'Sep', 'June', 'Jul', 'dec', 'Foo']
+YEARS = [1999, 2001, 99, 200, 1000, 2024, 1970]
+ZONES = [
+    '', ' -0500', ' +0000', ' -0000', ' +1400', ' +1500', ' -2400', ' GMT', ' UTC', ' UT', ' Z', ' EST', ' PST',
+    ' -0500 (EST)', ' +0100 (CET)', ' -0800 (Pacific Standard Time)', ' +0000 (GMT)', ' +0000 (UTC)',
+    ' -0700 (PDT)', ' +0530 (IST)', ' -0500 (est)', ' +0200 (CEST)', ' +0100 (BST)', ' +9999',
+]
+
+# What the cleaners did before the RFC 822 parser and the cache: dateutil for every date, with
+# offsets beyond +/-14 hours normalized to UTC and unparseable dates given up on
+def reference_normalize(date_str):
+    try:
+        post_date = date_parser.parse(date_str)
+        if post_date.utcoffset() is not None and abs(post_date.utcoffset().total_seconds() / 3600) > 14:
+            post_date = post_date.astimezone(tz.UTC)
+        return post_date
+    except (ValueError, OverflowError):
+        return None
+
+def described(post_date):
+    # Equal datetimes can differ in offset or zone name, so compare those too
+    if post_date is None or post_date.tzinfo is None:
+        return post_date, None, None
+    return post_date, post_date.utcoffset(), post_date.tzname()
+
+def random_dates(count, seed):
+    generator = random.Random(seed)
+    for _ in range(count):
+        seconds = generator.choice(['', f':{generator.randint(0, 61):02d}'])
+        yield (f"{generator.choice(DAYS)}{generator.randint(0, 32)} {generator.choice(MONTHS)} "
+               f"{generator.choice(YEARS)} {generator.randint(0, 25)}:{generator.randint(0, 61):02d}{seconds}"
+               f"{generator.choice(ZONES)}")
+
+def test_date_normalizer_matches_dateutil():
+    normalizer = DateNormalizer()
+    for date_str in random_dates(5000, seed=3):
+        assert described(normalizer.normalize(date_str)) == described(reference_normalize(date_str)), date_str
+
+def test_date_normalizer_cache_returns_the_same_dates():
+    normalizer = DateNormalizer(cache_size=10)
+    dates = list(random_dates(200, seed=4))
+    first = [described(normalizer.normalize(date_str)) for date_str in dates]
+    assert [described(normalizer.normalize(date_str)) for date_str in dates] == first
@@ -0,0 +1,87 @@
+import json
+import sqlite3
+import data_cleaner
+import dedup
+
+COMMENTS = [
+    {'comment': 'The first comment about the weather', 'date': 'Mon, 12 Mar 2001 14:22:11 -0500'},
+    {'comment': 'A second comment about something else', 'date': 'Mon, 12 Mar 2001 15:02:40 -0500'},
+    {'comment': 'The first comment about the weather', 'date': 'Tue, 13 Mar 2001 09:12:00 -0500'},
+    {'comment': 'A third comment, nothing like the others', 'date': 'Tue, 13 Mar 2001 10:45:19 -0500'},
+]
+
+def write_dump(path, records):
+    path.write_text(json.dumps(records))
+    return str(path)
+
+def clean(input_file, output_dir, dedup_path):
+    data_cleaner.process_file(input_file, str(output_dir), batch_size=2, dedup_path=dedup_path)
+    with open(output_dir / f"cleaned_{input_file.rsplit('/', 1)[-1]}") as f:
+        return json.load(f)
+
+def test_rerunning_a_file_keeps_the_same_comments(tmp_path):
+    dedup_path = str(tmp_path / 'dedup.sqlite')
+    input_file = write_dump(tmp_path / 'usenet_a.json', COMMENTS)
+
+    first = clean(input_file, tmp_path, dedup_path)
+    second = clean(input_file, tmp_path, dedup_path)
+
+    assert len(first) == 3
+    assert second == first
+
+def test_comments_kept_from_another_file_are_dropped(tmp_path):
+    dedup_path = str(tmp_path / 'dedup.sqlite')
+    first_file = write_dump(tmp_path / 'usenet_a.json', COMMENTS)
+    second_file = write_dump(tmp_path / 'usenet_b.json', COMMENTS[1:2] + [
+        {'comment': 'A comment only the second file has', 'date': 'Wed, 14 Mar 2001 08:00:00 -0500'},
+    ])
+
+    clean(first_file, tmp_path, dedup_path)
+    second = clean(second_file, tmp_path, dedup_path)
+
+    assert [entry['comment'] for entry in second] == ['a comment only the second file has']
+    # Running the first file again is unaffected by the second
+    assert len(clean(first_file, tmp_path, dedup_path)) == 3
+
+def test_uncommitted_comments_are_not_recorded(tmp_path):
+    dedup_path = str(tmp_path / 'dedup.sqlite')
+    texts = ['one comment', 'another comment']
+
+    with dedup.DedupStore(dedup_path) as store:
+        assert store.filter_new(texts, 'a.json', [0, 1]) == [True, True]
+        # The write failed, so nothing is committed
+
+    with dedup.DedupStore(dedup_path) as store:
+        assert store.filter_new(texts, 'b.json', [0, 1]) == [True, True]
+        store.commit()
+
+    dedup.reset(dedup_path)
+    with dedup.DedupStore(dedup_path) as store:
+        assert store.filter_new(texts, 'a.json', [0, 1]) == [True, True]
+
+def test_comments_committed_by_another_open_store_are_dropped(tmp_path):
+    dedup_path = str(tmp_path / 'dedup.sqlite')
+
+    with dedup.DedupStore(dedup_path) as first, dedup.DedupStore(dedup_path) as second:
+        assert first.filter_new(['crosspost'], 'a.json', [0]) == [True]
+        first.commit()
+
+        assert second.filter_new(['crosspost', 'only in b'], 'b.json', [0, 1]) == [False, True]
+        second.commit()
+        assert first.filter_new(['only in b'], 'a.json', [1]) == [False]
+
+def test_an_index_without_sequence_numbers_is_converted(tmp_path):
+    dedup_path = str(tmp_path / 'dedup.sqlite')
+    connection = sqlite3.connect(dedup_path)
+    connection.execute("CREATE TABLE origins (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+    connection.execute("INSERT INTO origins (id, name) VALUES (1, 'a.json')")
+    connection.execute(
+        "CREATE TABLE kept (digest BLOB PRIMARY KEY, origin INTEGER NOT NULL, position INTEGER NOT NULL) WITHOUT ROWID"
+    )
+    connection.execute("INSERT INTO kept VALUES (?, 1, 0)", (dedup.digest('an old comment'),))
+    connection.commit()
+    connection.close()
+
+    with dedup.DedupStore(dedup_path) as store:
+        assert store.filter_new(['an old comment'], 'b.json', [0]) == [False]
+        assert store.filter_new(['an old comment'], 'a.json', [0]) == [True]
@@ -0,0 +1,51 @@
+import io
+import json
+import random
+import pytest
+from json_stream import JsonArrayWriter, iter_records
+
+def random_value(generator, depth=0):
+    kinds = ['string', 'number', 'float', 'bool', 'null'] + (['list', 'dict'] if depth < 3 else [])
+    kind = generator.choice(kinds)
+    if kind == 'string':
+        return ''.join(generator.choice('ab \n"\\é\t') for _ in range(generator.randint(0, 6)))
+    if kind == 'number':
+        return generator.randint(-1000, 1000)
+    if kind == 'float':
+        return generator.uniform(-1e6, 1e6)
+    if kind == 'bool':
+        return generator.random() < 0.5
+    if kind == 'null':
+        return None
+    if kind == 'list':
+        return [random_value(generator, depth + 1) for _ in range(generator.randint(0, 3))]
+    return {f'key{i}': random_value(generator, depth + 1) for i in range(generator.randint(0, 3))}
+
+def test_json_array_writer_matches_json_dump():
+    generator = random.Random(9)
+    for _ in range(500):
+        records = [random_value(generator) for _ in range(generator.randint(0, 5))]
+        for indent in (2, 4):
+            expected = io.StringIO()
+            json.dump(records, expected, indent=indent)
+
+            written = io.StringIO()
+            with JsonArrayWriter(written, indent=indent) as writer:
+                for record in records:
+                    writer.write(record)
+
+            assert written.getvalue() == expected.getvalue(), records
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 1 << 20])
+def test_iter_records_does_not_cut_numbers_at_chunk_boundaries(tmp_path, chunk_size):
+    records = [-1.5, 1e-07, -2.5e+30, 12345, 'a,]b', [1.25, []], {'x': -500.0}, True, None]
+    path = tmp_path / 'records.json'
+    for text in ('[-1.5]', json.dumps(records), json.dumps(records, indent=4)):
+        path.write_text(text)
+        assert list(iter_records(str(path), chunk_size)) == json.loads(text)
+
+def test_iter_records_rejects_elements_without_delimiter(tmp_path):
+    path = tmp_path / 'records.json'
+    path.write_text('[1.5x]')
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_records(str(path), chunk_size=1))
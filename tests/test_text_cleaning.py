@@ -0,0 +1,109 @@
+import re
+import random
+import string
+import contractions
+from nltk.tokenize import word_tokenize
+from text_cleaning import (split_usenet_post, strip_usenet_headers, strip_quoted_lines, clean_text, regex_tokenize,
+                           check_tokenizer, normalize_usenet_comment)
+
+def test_header_block_is_split_from_body_and_quotes():
+    post = "From: someone@example.com\nSubject: hello\n  continued\n\nMy own text\n> their text\nmore of mine"
+
+    headers, body, quoted = split_usenet_post(post)
+
+    assert headers == ['From: someone@example.com', 'Subject: hello\n  continued']
+    assert body == 'My own text\nmore of mine'
+    assert quoted == ['> their text']
+
+def test_body_opening_with_a_colon_line_is_kept():
+    for post in ["Note: this is my text\nand more", "Note: this is my text\n\nand more"]:
+        assert split_usenet_post(post) == ([], post, [])
+
+def test_stripping_headers_keeps_quoted_lines():
+    post = "From: someone@example.com\nSubject: hello\n\nMy own text\n> their text\nmore of mine"
+
+    assert strip_usenet_headers(post) == "My own text\n> their text\nmore of mine"
+    assert strip_quoted_lines(strip_usenet_headers(post)) == "My own text\nmore of mine"
+    assert strip_usenet_headers("Note: this is my text\n> quoted") == "Note: this is my text\n> quoted"
+
+# The rule cascades the cleaners ran before their rules were compiled and merged, kept here as
+# the reference the optimized versions must match exactly
+def reference_clean_text(text):
+    for pattern, replacement in [
+        (r"http[s]?://[^\s]+", ""),
+        (r"\b\w*\.\w+\b", ""),
+        (r"\b\w*[-–—]+\w*\b", ""),
+        (r"\s+", " "),
+        (r"[^a-zA-Z\s]", ""),
+    ]:
+        text = re.sub(pattern, replacement, text)
+    text = text.lower()
+    text = contractions.fix(text)
+    text = text.translate(str.maketrans('', '', string.punctuation))
+    return ' '.join(nltk_tokenize(text))
+
+def reference_normalize_usenet_comment(comment):
+    comment = contractions.fix(comment)
+    for pattern, replacement in [
+        (r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', ''),
+        (r'\b\w*\.\w+\b', ''),
+        (r'\b\w*-\w+\b', ''),
+        (r'\b\w*[\.,;\'"!?]+\w+\b', ''),
+        (r'\b[A-Z]+\b', ''),
+        (r'\s+', ' '),
+        (r'^\s*Reply-To [^\w\s]+\s*$', ''),
+        (r'\b([a-zA-Z]+)\b', lambda match: match.group(0).lower()),
+        (r'[^a-zA-Z\s\'-]', ''),
+        (r'\S+@\S+', ''),
+        (r'X-Google-Thread:.*', ''),
+        (r'(--|Xref|X-Google-ArrivalTime|-- PST|Reply-To|X-Antivirus|MIME-Version|X-Usenet-Provider|X-Face|X-No-Archive|X-Plain|X-It-Strategy|X-Antivirus-Status|VPS|logging-data|X-Abuse-and-DMCA-Info|Injection-|From|X-Google-Thread|X-Google-Attributes|X-Google-NewGroupId|X-Google-Language|Received|Path|From|Newsgroups:|alt.politics.communism|Subject|Organization|Lines|Message-ID|NNTP-Posting-Host|Mime-Version|X-Trace|X-Complaints-To|NNTP-Posting-Date|Complaints-To|Injection-Info|posting-account|User-Agent|Bytes|Content-Type|Content-Transfer-Encoding|References|X-Priority|X-MSMail-Priority|X-Newsreader|X-MimeOLE|NNTP-Posting-).*', ''),
+    ]:
+        comment = re.sub(pattern, replacement, comment)
+    return comment
+
+def nltk_tokenize(text):
+    # Without sentence splitting, so Punkt is not needed; the cleaned texts have no sentence ends
+    return word_tokenize(text, preserve_line=True)
+
+def random_texts(pieces, count, max_pieces, seed):
+    generator = random.Random(seed)
+    for _ in range(count):
+        yield ''.join(generator.choice(['', ' ', '\n']) + generator.choice(pieces)
+                      for _ in range(generator.randint(0, max_pieces)))
+
+CLEAN_TEXT_PIECES = [
+    "I'm", "im", "cannot", "gonna", "wanna", "gimme", "lemme", "gotta", "Don't", "dont", "yall", "ya'll",
+    "hello", "World", "a.b", "x-y", "—", "http://x.y", "123", "é", "\n", " ", "\t", "ain't", "shouldve",
+    "wont", "cant", "tis", "'tis", "d'ye", "more'n", "o'clock", "i'd", "youre", "wasnt", "'", '"', "--",
+    "cannot.", "Cannot",
+]
+
+TOKENIZER_PIECES = [
+    "don't", "i'm", "'", "-", "--", "can't", "cannot", "gonna", "word", "won't", "it's", "'tis", "'twas",
+    "y'all", "ol'", "rock'n'roll", "a-b", "'hello'", "''", "hello'", "'s", "n't", "wanna", "Wanna", "D'ye",
+    "more'n", "'em",
+]
+
+USENET_PIECES = [
+    "From", "from", "Subject:", "X-Google-Thread:", "don't", "I'm", "hello", "WORLD", "é", "naïve", "abc1",
+    "a_b", "x@y.com", "http://a.b/c", "--", "-", "'", '"', "e.g.", "logging-data", "posting-account",
+    "alt.politics.communism", "Reply-To", "Ünïcode", "Straße", "can't", "\n", " ", "\t", "ok!", "?",
+    "X-Trace", "VPS", "Vps", "NNTP-Posting-Host:", "3rd", "A1B", "ΑΒΓ", "ǅ", "K",
+]
+
+def test_clean_text_matches_the_rule_cascade():
+    for text in random_texts(CLEAN_TEXT_PIECES, 3000, 10, seed=2):
+        assert clean_text(text) == reference_clean_text(text), text
+
+def test_regex_tokenizer_matches_nltk():
+    for text in random_texts(TOKENIZER_PIECES, 3000, 8, seed=3):
+        text = ' '.join(text.split())
+        assert regex_tokenize(text) == nltk_tokenize(text), text
+
+def test_normalize_usenet_comment_matches_the_rule_cascade():
+    for comment in random_texts(USENET_PIECES, 5000, 12, seed=1):
+        assert normalize_usenet_comment(comment) == reference_normalize_usenet_comment(comment), comment
+
+def test_check_tokenizer_normalizes_raw_comments():
+    comments = list(random_texts(CLEAN_TEXT_PIECES + TOKENIZER_PIECES, 200, 10, seed=5))
+    assert check_tokenizer(comments, 'regex', sample_size=100) == []